@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import google.generativeai as genai
+
+AI_MODEL = 'gemini-1.5-flash'
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available, then takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def _is_retryable(error):
+    """
+    Quota/rate-limit errors and timeouts are worth retrying; anything else is not.
+    """
+    if isinstance(error, (FutureTimeoutError, TimeoutError)):
+        return True
+    text = str(error).lower()
+    return any(s in text for s in ("429", "quota", "resource exhausted", "resourceexhausted", "rate limit"))
+
+class GeminiClient:
+    """
+    Shared Gemini client, configured once, that runs many generate_content calls concurrently.
+    Requests go through a token-bucket rate limiter, are bounded to max_concurrency at a time,
+    time out after `timeout` seconds and retry with exponential backoff on quota errors.
+    Pass `model` (anything with generate_content(prompt) -> obj.text) to run against a fake.
+    """
+
+    def __init__(self, api_key=None, model=None, model_name=AI_MODEL, max_concurrency=4,
+                 requests_per_minute=60, timeout=60, max_retries=3, backoff=1.0):
+        if model is None:
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(model_name)
+        self.model = model
+        self.model_name = model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = TokenBucket(requests_per_minute / 60.0, capacity=max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="gemini")
+        # Calls run here so a hung request can be abandoned after `timeout`
+        self._calls = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="gemini-call")
+
+    def generate(self, prompt):
+        """
+        Blocking call. Returns the response text or raises the last error.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self._calls.submit(self.model.generate_content, prompt).result(timeout=self.timeout)
+                return response.text
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+    def submit(self, prompt):
+        """
+        Non-blocking call. Returns a Future resolving to the response text.
+        """
+        return self._pool.submit(self.generate, prompt)
+
+    def submit_task(self, fn, *args):
+        """
+        Runs fn(*args) on the client's request pool, for callers that wrap generate().
+        """
+        return self._pool.submit(fn, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+        self._calls.shutdown(wait=False)
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """
+    Returns the process-wide client for GEMINI_API_KEY, or None when no key is set.
+    Tuned by AI_MAX_CONCURRENCY (default 4), AI_REQUESTS_PER_MINUTE (default 60) and AI_TIMEOUT (default 60s).
+    """
+    global _client, _client_key
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        return None
+    with _client_lock:
+        if _client is None or _client_key != api_key:
+            _client = GeminiClient(
+                api_key=api_key,
+                max_concurrency=int(os.getenv('AI_MAX_CONCURRENCY', 4)),
+                requests_per_minute=float(os.getenv('AI_REQUESTS_PER_MINUTE', 60)),
+                timeout=float(os.getenv('AI_TIMEOUT', 60))
+            )
+            _client_key = api_key
+        return _client
@@ -0,0 +1,86 @@
+import os
+import re
+import zipfile
+import tempfile
+import unicodedata
+
+# Names Windows refuses as file names, with or without an extension
+_RESERVED_NAMES = {"CON", "PRN", "AUX", "NUL", *(f"COM{i}" for i in range(1, 10)), *(f"LPT{i}" for i in range(1, 10))}
+
+def safe_filename(name, default="report", max_length=120):
+    """
+    A file name that is safe on every OS and inside a ZIP: no path separators, control or
+    reserved characters, no leading/trailing dots or spaces, not a reserved device name,
+    and at most max_length characters (the extension is kept).
+    """
+    name = unicodedata.normalize("NFC", str(name))
+    name = re.sub(r'[\x00-\x1f\x7f<>:"/\\|?*]', "-", name)
+    name = re.sub(r"\s+", " ", name).strip(" .")
+    stem, ext = os.path.splitext(name)
+    if stem.split(".")[0].upper() in _RESERVED_NAMES:
+        stem = f"_{stem}"
+    stem = stem[:max(1, max_length - len(ext))].rstrip(" .")
+    return (stem or default) + ext
+
+class ReportArchive:
+    """
+    A ZIP written entry by entry to a temporary file, so memory use does not grow with the
+    number of reports. PDFs are stored without recompression. Entry names are sanitized
+    and made unique. save() keeps the finished archive; used as a context manager, an
+    archive that was not saved is discarded on exit.
+    """
+
+    def __init__(self, folder=None):
+        fd, self.path = tempfile.mkstemp(suffix=".zip", dir=folder)
+        self.file = os.fdopen(fd, "w+b")
+        self._zip = zipfile.ZipFile(self.file, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._names = set()
+        self.count = 0
+        self.saved = False
+
+    def add(self, name, data):
+        """
+        Writes one entry and returns the name it was stored under.
+        """
+        name = safe_filename(name)
+        stem, ext = os.path.splitext(name)
+        unique, n = name, 1
+        while unique.lower() in self._names:
+            n += 1
+            unique = f"{stem} ({n}){ext}"
+        self._names.add(unique.lower())
+        # PDFs are already compressed; deflating them again only costs CPU
+        compression = zipfile.ZIP_STORED if ext.lower() == ".pdf" else zipfile.ZIP_DEFLATED
+        self._zip.writestr(unique, data, compress_type=compression)
+        self.count += 1
+        return unique
+
+    def save(self, path):
+        """
+        Closes the archive and moves it to path, for results kept on disk.
+        """
+        self._zip.close()
+        self.file.close()
+        os.replace(self.path, path)
+        self.path = path
+        self.saved = True
+        return path
+
+    def close(self):
+        """
+        Discards an unfinished archive; does nothing once it has been saved.
+        """
+        if self.saved:
+            return
+        self._zip.close()
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
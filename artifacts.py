@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+class ArtifactCache:
+    """
+    Rendered report PDFs on disk, content-addressed: the key is a hash of everything that
+    goes into the PDF (see make_key), so an outlet whose inputs are unchanged is served
+    from disk instead of being rendered again. Entries older than max_age seconds are
+    ignored (the PDF still shows the time it was generated), and the least recently used
+    entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, max_age=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, counted lazily
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.pdf")
+
+    def get(self, key):
+        """
+        Returns the cached PDF bytes, or None.
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.max_age is not None and time.time() - stat.st_mtime > self.max_age:
+                raise FileNotFoundError(path)
+            with open(path, "rb") as f:
+                pdf = f.read()
+            # Record the access for LRU eviction; mtime keeps the render time
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return pdf
+
+    def set(self, key, pdf):
+        if not self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(pdf) - old_size
+            if self._size is None or self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".pdf"):
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        # Called with the lock held
+        entries = self._entries()
+        size = sum(s for _, s, _ in entries)
+        if size > self.max_bytes:
+            # Down to 90% so eviction does not run on every write
+            target = self.max_bytes * 0.9
+            for _, entry_size, path in sorted(entries):
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entry_size
+                except OSError:
+                    pass
+        self._size = size
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries()
+            self._size = sum(s for _, s, _ in entries)
+            return {"entries": len(entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+def get_artifact_cache():
+    """
+    Returns the shared PDF cache, configured from the environment: PDF_CACHE_DIR,
+    PDF_CACHE_MAX_MB (default 500; 0 disables storing) and PDF_CACHE_MAX_AGE_HOURS (default 24).
+    """
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache(
+                os.getenv('PDF_CACHE_DIR', os.path.join('.cache', 'pdfs')),
+                max_bytes=float(os.getenv('PDF_CACHE_MAX_MB', 500)) * 1024 * 1024,
+                max_age=float(os.getenv('PDF_CACHE_MAX_AGE_HOURS', 24)) * 3600
+            )
+        return _artifact_cache
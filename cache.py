@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+class MemoCache:
+    """
+    Small on-disk memoization cache backed by SQLite.
+    Entries expire after ttl seconds and the least recently used ones are evicted past max_entries.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS memo ("
+                " key TEXT PRIMARY KEY, namespace TEXT, value TEXT,"
+                " created_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS memo_accessed ON memo (accessed_at)")
+
+    def _connect(self):
+        # One connection per operation keeps the cache safe to share between threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(namespace, *parts):
+        """
+        Stable hash of a namespace and its key parts (lists and tuples hash by content).
+        """
+        payload = json.dumps([namespace, parts], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, namespace, *parts):
+        """
+        Returns (hit, value). Expired entries count as misses and are removed.
+        """
+        key = self.make_key(namespace, *parts)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM memo WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM memo WHERE key = ?", (key,))
+                row = None
+            if row:
+                conn.execute("UPDATE memo SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return (True, json.loads(row[0])) if row else (False, None)
+
+    def set(self, namespace, *parts, value):
+        key = self.make_key(namespace, *parts)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO memo (key, namespace, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(value), now, now)
+            )
+            if self.max_entries:
+                conn.execute(
+                    "DELETE FROM memo WHERE key IN ("
+                    " SELECT key FROM memo ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM memo")
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this process and the number of stored entries.
+        """
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+_ai_cache = None
+_ai_cache_lock = threading.Lock()
+
+def get_ai_cache():
+    """
+    Returns the shared cache for AI results, configured from the environment:
+    AI_CACHE_PATH, AI_CACHE_TTL_DAYS (default 30) and AI_CACHE_MAX_ENTRIES (default 5000).
+    """
+    global _ai_cache
+    with _ai_cache_lock:
+        if _ai_cache is None:
+            _ai_cache = MemoCache(
+                os.getenv('AI_CACHE_PATH', os.path.join('.cache', 'ai_cache.sqlite3')),
+                ttl=float(os.getenv('AI_CACHE_TTL_DAYS', 30)) * 86400,
+                max_entries=int(os.getenv('AI_CACHE_MAX_ENTRIES', 5000))
+            )
+        return _ai_cache
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import datetime
+import threading
+import pandas as pd
+
+TREND_METRICS = ['orders', 'kpt', 'kitchen_errors', 'mfr_errors', 'mfr_cancellations']
+
+def iso_week(date=None):
+    """
+    Week label used as the history key, e.g. '2026-W42'.
+    """
+    year, week, _ = (date or datetime.date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def sparkline_points(values, width=120, height=24):
+    """
+    SVG polyline points for a small trend line; missing values are skipped.
+    """
+    points = [(i, float(v)) for i, v in enumerate(values) if v is not None and v == v]
+    if len(points) < 2:
+        return ""
+    low = min(v for _, v in points)
+    high = max(v for _, v in points)
+    span = (high - low) or 1.0
+    step = width / max(1, len(values) - 1)
+    return " ".join(f"{i * step:.1f},{height - 2 - (v - low) / span * (height - 4):.1f}" for i, v in points)
+
+class MetricsHistory:
+    """
+    Weekly metrics per outlet in SQLite, keyed by (brand_key, location_key, week).
+    record() upserts a week for every outlet at once; only runs over freshly ingested data
+    should record, so a preview or an old snapshot never overwrites a week's real metrics.
+    Trends for a whole batch come from one joined query instead of one query per outlet,
+    and compare the data being reported against earlier recorded weeks without writing.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('HISTORY_DB', os.path.join('data', 'history.sqlite3'))
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        columns = ", ".join(f"{m} REAL" for m in TREND_METRICS)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                " brand_key TEXT, location_key TEXT, week TEXT, brand TEXT, location TEXT,"
+                f" {columns}, recorded_at TEXT,"
+                " PRIMARY KEY (brand_key, location_key, week))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _value(v):
+        return None if pd.isna(v) else float(v)
+
+    def record(self, current, week=None):
+        """
+        Upserts this week's metrics. current has brand_key, location_key, brand, location
+        and the TREND_METRICS columns, one row per outlet.
+        """
+        week = week or iso_week()
+        now = datetime.datetime.now().isoformat()
+        rows = [
+            (r.brand_key, r.location_key, week, str(r.brand), str(r.location),
+             *(self._value(getattr(r, m)) for m in TREND_METRICS), now)
+            for r in current.itertuples(index=False)
+        ]
+        placeholders = ", ".join("?" * (len(TREND_METRICS) + 6))
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO metrics (brand_key, location_key, week, brand, location, {', '.join(TREND_METRICS)}, recorded_at)"
+                f" VALUES ({placeholders})",
+                rows
+            )
+
+    def load(self, keys, weeks=8, week=None):
+        """
+        History for the given outlets over the last `weeks` recorded weeks up to `week`,
+        in one query joined against a temporary key table. keys has brand_key and location_key columns.
+        """
+        week = week or iso_week()
+        with self._lock, self._connect() as conn:
+            conn.execute("CREATE TEMP TABLE batch_keys (brand_key TEXT, location_key TEXT)")
+            conn.executemany("INSERT INTO batch_keys VALUES (?, ?)", keys[['brand_key', 'location_key']].drop_duplicates().itertuples(index=False))
+            history = pd.read_sql_query(
+                f"SELECT m.brand_key, m.location_key, m.week, {', '.join('m.' + c for c in TREND_METRICS)}"
+                " FROM metrics m JOIN batch_keys k ON m.brand_key = k.brand_key AND m.location_key = k.location_key"
+                " WHERE m.week <= ?",
+                conn, params=[week]
+            )
+            conn.execute("DROP TABLE batch_keys")
+        recent = sorted(history['week'].unique())[-weeks:]
+        return history[history['week'].isin(recent)]
+
+    def trends(self, current, weeks=8, week=None):
+        """
+        Week-over-week view for a batch of outlets, computed with vectorized pandas operations.
+        current's values stand for `week`, compared with the recorded weeks before it.
+        Returns a DataFrame indexed by (brand_key, location_key) with, for each metric m,
+        m_prev (last week's value), m_delta (current minus previous) and m_series (values oldest first).
+        """
+        week = week or iso_week()
+        values = current.drop_duplicates(['brand_key', 'location_key']).set_index(['brand_key', 'location_key'])
+        index = values.index
+        history = self.load(current, weeks=weeks, week=week)
+        history = history[history['week'] < week]
+        weeks_seen = sorted(history['week'].unique())[-(weeks - 1):] if weeks > 1 else []
+        history = history[history['week'].isin(weeks_seen)]
+
+        out = pd.DataFrame(index=index)
+        for m in TREND_METRICS:
+            cur = pd.to_numeric(values[m], errors='coerce') if m in values.columns else pd.Series(float('nan'), index=index)
+            if weeks_seen:
+                wide = history.pivot_table(index=['brand_key', 'location_key'], columns='week', values=m, aggfunc='last')
+                wide = wide.reindex(index=index, columns=weeks_seen)
+                prev = wide.ffill(axis=1).iloc[:, -1]
+                earlier = wide.values.tolist()
+            else:
+                prev = pd.Series(float('nan'), index=index)
+                earlier = [[] for _ in range(len(index))]
+            out[f"{m}_prev"] = prev
+            out[f"{m}_delta"] = cur - prev
+            out[f"{m}_series"] = [series + [value] for series, value in zip(earlier, cur.tolist())]
+        return out
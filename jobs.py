@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import ReportArchive, safe_filename
+from journal import get_journal
+from main import email_reports, generate_consolidated_reports, generate_reports_parallel
+
+# Job states
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+class Job:
+    """
+    One bulk run submitted to the JobQueue. Its worker thread updates the status, progress
+    and output; the UI only reads them. Per-outlet results are in the run journal under run_id.
+    """
+
+    def __init__(self, kind, label, folder, owner=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.folder = os.path.join(folder, self.job_id)
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.run_id = None
+        self.output = None  # path of the finished PDF or ZIP
+        self.output_name = None
+        self.summary = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Asks the job to stop; a queued job never starts, a running one stops at the next outlet.
+        """
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def progress(self, done, total):
+        self.done, self.total = done, total
+
+class JobQueue:
+    """
+    Runs bulk jobs on a small pool of background threads, so a long run neither blocks the
+    Streamlit session that started it nor stops when that session reruns or disconnects.
+    The queue is shared by every session of the process: jobs beyond the pool size wait
+    their turn. Each job renders PDFs on its own process pool as before.
+    """
+
+    def __init__(self, workers=None, folder=None, history=None):
+        self.workers = max(1, int(workers or os.getenv('JOB_WORKERS', 2)))
+        self.folder = folder or os.getenv('JOB_OUTPUT_DIR', os.path.join('data', 'jobs'))
+        self.history = int(history or os.getenv('JOB_HISTORY', 50))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, label, fn, *args, owner=None, **kwargs):
+        """
+        Queues fn(job, *args, **kwargs) and returns its Job.
+        """
+        job = Job(kind, label, self.folder, owner=owner)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status, job.finished_at = CANCELLED, time.time()
+            return
+        job.status, job.started_at = RUNNING, time.time()
+        try:
+            os.makedirs(job.folder, exist_ok=True)
+            fn(job, *args, **kwargs)
+            job.status = CANCELLED if job.cancelled else DONE
+        except Exception as e:
+            job.status, job.error = FAILED, str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        # Called with the lock held: forget the oldest finished jobs and their files
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job.job_id]
+            shutil.rmtree(job.folder, ignore_errors=True)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, owner=None):
+        """
+        Jobs newest first, only the owner's if given.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in reversed(jobs) if owner is None or job.owner == owner]
+
+    def active(self):
+        return [job for job in self.jobs() if not job.finished]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job:
+            job.cancel()
+        return job
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """
+    Returns the process-wide JobQueue (JOB_WORKERS jobs at a time, output in JOB_OUTPUT_DIR).
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
+
+# Job functions: fn(job, ...) as passed to JobQueue.submit
+
+def generate_job(job, prepared, mode="outlet", workers=None, spreadsheet_url=None, include_ai=False, history=None):
+    """
+    Renders every outlet's PDF into a ZIP (mode "outlet"), one PDF per brand into a ZIP
+    ("brand") or one fleet PDF ("fleet"), saved as the job's output. Fails when nothing
+    could be produced.
+    """
+    journal = get_journal()
+    pairs = prepared.outlet_pairs()
+    job.run_id = journal.start_run('render', pairs, params={"mode": mode, "job": job.job_id})
+    job.total = len(pairs)
+    failed = 0
+    try:
+        with ReportArchive(job.folder) as archive:
+            if mode == "outlet":
+                reused = rendered = 0
+                reports = generate_reports_parallel(
+                    prepared, pairs, workers=workers, spreadsheet_url=spreadsheet_url,
+                    include_ai=include_ai, history=history, on_progress=job.progress
+                )
+                try:
+                    for result in reports:
+                        if job.cancelled:
+                            break
+                        if result.error:
+                            failed += 1
+                            journal.mark(job.run_id, result.brand, result.location, 'failed', detail=result.error)
+                            continue
+                        if result.cached: reused += 1
+                        else: rendered += 1
+                        archive.add(f"{result.brand}_{result.location}_report.pdf", result.pdf)
+                        journal.mark(job.run_id, result.brand, result.location, 'rendered', recipient=result.manager_email)
+                finally:
+                    reports.close()
+                job.summary = f"♻️ {reused} reused from cache • 🖨️ {rendered} rendered • ❌ {failed} failed"
+            else:
+                fleet_pdf = None
+                bundles = generate_consolidated_reports(
+                    prepared, pairs, mode=mode, workers=workers, spreadsheet_url=spreadsheet_url,
+                    include_ai=include_ai, history=history, on_progress=job.progress
+                )
+                try:
+                    for bundle in bundles:
+                        if job.cancelled:
+                            break
+                        for b, l in bundle.outlets:
+                            journal.mark(job.run_id, b, l, 'failed' if bundle.error else 'rendered', detail=bundle.error)
+                        for b, l, error in bundle.failed:
+                            journal.mark(job.run_id, b, l, 'failed', detail=error)
+                        failed += len(bundle.failed) + (len(bundle.outlets) if bundle.error else 0)
+                        if bundle.error:
+                            continue
+                        if mode == "fleet":
+                            fleet_pdf = bundle.pdf
+                        else:
+                            archive.add(f"{bundle.name}_report.pdf", bundle.pdf)
+                finally:
+                    bundles.close()
+                job.summary = f"{len(pairs) - failed} outlets included • ❌ {failed} failed"
+
+            # An archive that is not saved here is discarded on leaving the block
+            if not job.cancelled and mode == "fleet" and fleet_pdf:
+                job.output_name = "Fleet_report.pdf"
+                job.output = os.path.join(job.folder, job.output_name)
+                with open(job.output, "wb") as f:
+                    f.write(fleet_pdf)
+            elif not job.cancelled and mode != "fleet" and archive.count:
+                job.output_name = "Reports.zip" if mode == "outlet" else "Brand_Reports.zip"
+                job.output = archive.save(os.path.join(job.folder, safe_filename(job.output_name)))
+    finally:
+        journal.finish_run(job.run_id, 'cancelled' if job.cancelled else None)
+
+    if job.output is None and not job.cancelled:
+        raise RuntimeError(f"No reports were produced: {failed} of {len(pairs)} outlets failed")
+
+def email_job(job, prepared, run_id=None, source=None, **options):
+    """
+    Emails every outlet's report to its manager, or continues the journal run run_id, which
+    must have been started on the same source (see journal.source_fingerprint).
+    options are passed to email_reports.
+    """
+    journal = get_journal()
+    if run_id is None:
+        run_id = journal.start_run('email', prepared.outlet_pairs(), params={"job": job.job_id, "source": source, "group_emails": options.get("group_by_recipient")})
+    else:
+        journal.check_source(run_id, source)
+    job.run_id = run_id
+    pairs = journal.pending(run_id)
+    job.total = len(pairs)
+    outcomes = email_reports(
+        prepared, pairs, journal=journal, run_id=run_id,
+        on_progress=job.progress, cancel=job.cancel_event, **options
+    )
+    sent = sum(1 for o in outcomes if o.status == 'sent')
+    unconfirmed = sum(1 for o in outcomes if o.status == 'unconfirmed')
+    job.summary = f"📨 Sent {sent} / {len(pairs)} emails" + (f" • ⚠️ {unconfirmed} unconfirmed (check by hand)" if unconfirmed else "")
+    if job.cancelled:
+        journal.finish_run(run_id, 'cancelled')
@@ -0,0 +1,234 @@
+import os
+import json
+import uuid
+import hashlib
+import sqlite3
+import datetime
+import threading
+
+# Outlet states. A run is finished for an outlet once it reaches one of its kind's done states.
+# UNCONFIRMED: a send was cut off mid-flight, so it may or may not have been delivered; it is
+# never retried automatically and needs checking by hand.
+PENDING, RENDERED, SENT, SKIPPED, FAILED = 'pending', 'rendered', 'sent', 'skipped', 'failed'
+UNCONFIRMED = 'unconfirmed'
+DONE_STATES = {
+    'email': (SENT, SKIPPED, UNCONFIRMED),
+    'render': (RENDERED,),
+}
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+def source_fingerprint(sheets=(), uploads=(), snapshot=None):
+    """
+    Identifies the data a run was started on: the sheet URLs (or names), the content of
+    each uploaded file (bytes) and the snapshot path. Stored as the run's "source" param so a
+    run is only resumed on the same data.
+    """
+    parts = sorted(f"sheet:{url}" for url in sheets)
+    parts += sorted(f"upload:{hashlib.sha256(data).hexdigest()}" for data in uploads)
+    if snapshot:
+        parts.append(f"snapshot:{os.path.abspath(snapshot)}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+class RunJournal:
+    """
+    Durable record of bulk runs in SQLite: one row per outlet per run with its state
+    (pending, rendered, sent, skipped or failed), so an interrupted run can be resumed with
+    only its unfinished outlets.
+
+    Deliveries are claimed per (run, recipient, outlet) before a message is sent. A resumed
+    run never mails an outlet that was already sent, or that was mid-send when the run died,
+    to the same manager again; the latter ends as 'unconfirmed'.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('JOURNAL_DB', os.path.join('data', 'journal.sqlite3'))
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, created_at TEXT, updated_at TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outlets ("
+                " run_id TEXT, position INTEGER, brand TEXT, location TEXT, state TEXT, recipient TEXT,"
+                " detail TEXT, attempts INTEGER DEFAULT 0, updated_at TEXT,"
+                " PRIMARY KEY (run_id, brand, location))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " run_id TEXT, recipient TEXT, brand TEXT, location TEXT, state TEXT, updated_at TEXT,"
+                " PRIMARY KEY (run_id, recipient, brand, location))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Runs
+
+    def start_run(self, kind, pairs, params=None, run_id=None):
+        """
+        Records a new run with every outlet pending and returns its id.
+        """
+        run_id = run_id or f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        now = _now()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, 'running', ?, ?)",
+                (run_id, kind, json.dumps(params or {}, default=str), now, now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO outlets (run_id, position, brand, location, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, i, str(b), str(l), PENDING, now) for i, (b, l) in enumerate(pairs)]
+            )
+        return run_id
+
+    def run(self, run_id):
+        """
+        The run's kind, params, status and state counts, or None if it does not exist.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT kind, params, status, created_at, updated_at FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if not row:
+                return None
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM outlets WHERE run_id = ? GROUP BY state", (run_id,)).fetchall())
+        kind, params, status, created_at, updated_at = row
+        return {"run_id": run_id, "kind": kind, "params": json.loads(params or "{}"), "status": status,
+                "created_at": created_at, "updated_at": updated_at, "counts": counts}
+
+    def runs(self, limit=20, kind=None):
+        """
+        Most recent runs first, as returned by run().
+        """
+        query = "SELECT run_id FROM runs" + (" WHERE kind = ?" if kind else "") + " ORDER BY created_at DESC, rowid DESC LIMIT ?"
+        with self._lock, self._connect() as conn:
+            ids = [r[0] for r in conn.execute(query, (kind, limit) if kind else (limit,)).fetchall()]
+        return [self.run(run_id) for run_id in ids]
+
+    def latest_unfinished(self, kind=None, exclude=(), source=None):
+        """
+        The most recent run that still has unfinished outlets, or None.
+        Runs in exclude (e.g. ones still in progress) are passed over, and with source
+        (a source_fingerprint) so are runs started on other data.
+        """
+        for run in self.runs(limit=50, kind=kind):
+            if source is not None and run["params"].get("source") != source:
+                continue
+            if run["run_id"] not in exclude and self.pending(run["run_id"]):
+                return run
+        return None
+
+    def check_source(self, run_id, source):
+        """
+        Raises ValueError unless run run_id exists and was started on the data identified by
+        source. Outlets are matched by name, so resuming on other data could mail the wrong outlet.
+        """
+        run = self.run(run_id)
+        if run is None:
+            raise ValueError(f"No run to resume: {run_id}")
+        if run["params"].get("source") != source:
+            raise ValueError(f"Run {run_id} was started on different data; load the same sources to resume it")
+        return run
+
+    def finish_run(self, run_id, status=None):
+        """
+        Marks the run 'complete' when every outlet is done, else 'incomplete' (or the given status).
+        """
+        status = status or ("incomplete" if self.pending(run_id) else "complete")
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?", (status, _now(), run_id))
+        return status
+
+    # Outlets
+
+    def pending(self, run_id):
+        """
+        (brand, location) pairs of the run that have not reached a done state, in original order.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT kind FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if not row:
+                raise ValueError(f"Unknown run: {run_id}")
+            done = DONE_STATES.get(row[0], DONE_STATES['email'])
+            rows = conn.execute(
+                f"SELECT brand, location FROM outlets WHERE run_id = ? AND state NOT IN ({', '.join('?' * len(done))}) ORDER BY position",
+                (run_id, *done)
+            ).fetchall()
+        return [(b, l) for b, l in rows]
+
+    def mark(self, run_id, brand, location, state, recipient=None, detail=None):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE outlets SET state = ?, recipient = COALESCE(?, recipient), detail = ?, updated_at = ?,"
+                " attempts = attempts + ? WHERE run_id = ? AND brand = ? AND location = ?",
+                (state, None if recipient is None else str(recipient), detail, _now(), 1 if state == FAILED else 0,
+                 run_id, str(brand), str(location))
+            )
+
+    def outlets(self, run_id):
+        """
+        Every outlet row of the run as dicts, in original order.
+        """
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT brand, location, state, recipient, detail, attempts, updated_at FROM outlets WHERE run_id = ? ORDER BY position",
+                (run_id,)
+            ).fetchall()
+        keys = ["brand", "location", "state", "recipient", "detail", "attempts", "updated_at"]
+        return [dict(zip(keys, row)) for row in rows]
+
+    # Idempotent delivery
+
+    def claim(self, run_id, recipient, outlets):
+        """
+        Claims the right to mail each (brand, location) to recipient in this run.
+        Returns {(brand, location): None if claimed now, else the earlier delivery's state}.
+        """
+        now = _now()
+        result = {}
+        with self._lock, self._connect() as conn:
+            for brand, location in outlets:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?, ?, 'sending', ?)",
+                    (run_id, str(recipient), str(brand), str(location), now)
+                )
+                if cur.rowcount:
+                    result[(brand, location)] = None
+                else:
+                    result[(brand, location)] = conn.execute(
+                        "SELECT state FROM deliveries WHERE run_id = ? AND recipient = ? AND brand = ? AND location = ?",
+                        (run_id, str(recipient), str(brand), str(location))
+                    ).fetchone()[0]
+        return result
+
+    def complete(self, run_id, recipient, outlets, success):
+        """
+        Records the result of a claimed delivery; a failed one is released so a resume can retry it.
+        """
+        with self._lock, self._connect() as conn:
+            for brand, location in outlets:
+                key = (run_id, str(recipient), str(brand), str(location))
+                if success:
+                    conn.execute(
+                        "UPDATE deliveries SET state = 'sent', updated_at = ? WHERE run_id = ? AND recipient = ? AND brand = ? AND location = ?",
+                        (_now(), *key)
+                    )
+                else:
+                    conn.execute("DELETE FROM deliveries WHERE run_id = ? AND recipient = ? AND brand = ? AND location = ?", key)
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    """
+    Returns the shared RunJournal (JOURNAL_DB, default data/journal.sqlite3).
+    """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = RunJournal()
+        return _journal
@@ -0,0 +1,198 @@
+import os
+import queue
+import ssl
+import smtplib
+import datetime
+from email.message import EmailMessage
+
+def build_report_message(pdf_content, recipient, brand, sender):
+    """
+    Builds the weekly report email with the PDF attached.
+    """
+    msg = EmailMessage()
+    msg['Subject'] = f"Weekly Performance Report: {brand}"
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg.set_content(f"Hello,\n\nPlease find the attached performance report for {brand}.\n\nGenerated by Kytchens Intelligence.")
+
+    msg.add_attachment(
+        pdf_content,
+        maintype='application',
+        subtype='pdf',
+        filename=f"{brand}_Report_{datetime.date.today()}.pdf"
+    )
+    return msg
+
+def _attachment_name(text):
+    return "".join(c if c.isalnum() or c in " -_." else "-" for c in str(text)).strip()
+
+def build_grouped_message(reports, recipient, sender):
+    """
+    Builds one email carrying several report PDFs. reports is a list of (brand, location, pdf).
+    """
+    brands = sorted({str(b) for b, _, _ in reports})
+    title = brands[0] if len(brands) == 1 else f"{len(reports)} outlets"
+
+    msg = EmailMessage()
+    msg['Subject'] = f"Weekly Performance Report: {title}"
+    msg['From'] = sender
+    msg['To'] = recipient
+    outlet_lines = "\n".join(f"- {b} / {l}" for b, l, _ in reports)
+    msg.set_content(f"Hello,\n\nPlease find the attached performance reports for:\n{outlet_lines}\n\nGenerated by Kytchens Intelligence.")
+
+    for brand, location, pdf in reports:
+        msg.add_attachment(
+            pdf,
+            maintype='application',
+            subtype='pdf',
+            filename=f"{_attachment_name(brand)}_{_attachment_name(location)}_Report_{datetime.date.today()}.pdf"
+        )
+    return msg
+
+# Room for a message's headers and body, and for each attachment's MIME part headers
+MESSAGE_OVERHEAD = 8192
+ATTACHMENT_OVERHEAD = 512
+
+def encoded_size(data):
+    """
+    Bytes an attachment takes on the wire: base64 (4 bytes per 3) in 76-character lines
+    ending in CRLF, plus its part headers. About 35% more than len(data).
+    """
+    encoded = -(-len(data) // 3) * 4
+    return encoded + 2 * -(-encoded // 76) + ATTACHMENT_OVERHEAD
+
+def split_by_size(items, max_bytes, size=len):
+    """
+    Splits items into consecutive chunks whose total size(item) is at most max_bytes.
+    An item larger than the limit goes in a chunk on its own.
+    """
+    chunks, current, total = [], [], 0
+    for item in items:
+        item_size = size(item)
+        if current and total + item_size > max_bytes:
+            chunks.append(current)
+            current, total = [], 0
+        current.append(item)
+        total += item_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+class _Connection:
+    """
+    One SMTP session and the number of messages sent on it.
+    """
+
+    def __init__(self):
+        self.smtp = None
+        self.sent = 0
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+        self.smtp = None
+        self.sent = 0
+
+class Mailer:
+    """
+    Keeps authenticated SMTP connections open across many send_message calls.
+    Reconnects transparently when the server drops a connection and rotates each
+    connection after max_per_connection messages. Up to pool_size connections can be
+    used at once from worker threads.
+
+    Defaults come from EMAIL_USER / EMAIL_PASS and SMTP_HOST (smtp.gmail.com),
+    SMTP_PORT (465), SMTP_SSL (on for port 465) and SMTP_MAX_PER_CONNECTION (50).
+    Without SMTP_SSL the connection is upgraded with STARTTLS when the server offers it,
+    and credentials are never sent over a connection that is not encrypted.
+    Without credentials no login is attempted, which suits a local debugging server.
+    """
+
+    def __init__(self, user=None, password=None, host=None, port=None, use_ssl=None,
+                 max_per_connection=None, pool_size=1, timeout=60):
+        self.user = user if user is not None else os.getenv('EMAIL_USER')
+        self.password = password if password is not None else os.getenv('EMAIL_PASS')
+        self.host = host or os.getenv('SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(port or os.getenv('SMTP_PORT', 465))
+        if use_ssl is None:
+            use_ssl = os.getenv('SMTP_SSL', 'true' if self.port == 465 else 'false').lower() in ('1', 'true', 'yes')
+        self.use_ssl = use_ssl
+        self.max_per_connection = int(max_per_connection or os.getenv('SMTP_MAX_PER_CONNECTION', 50))
+        self.timeout = timeout
+
+        self._all = [_Connection() for _ in range(max(1, int(pool_size)))]
+        self._idle = queue.Queue()
+        for conn in self._all:
+            self._idle.put(conn)
+
+    def _connect(self, conn):
+        conn.close()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            # Upgrade plain connections (e.g. port 587) so credentials never travel in clear text
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            elif self.user and self.password:
+                smtp.close()
+                raise smtplib.SMTPNotSupportedError(f"{self.host}:{self.port} does not offer STARTTLS; not sending credentials unencrypted")
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        conn.smtp = smtp
+
+    def send_message(self, msg):
+        """
+        Sends one message, reusing an open connection. Retries once on a fresh
+        connection if the server has disconnected.
+        """
+        conn = self._idle.get()
+        try:
+            if conn.smtp is None or conn.sent >= self.max_per_connection:
+                self._connect(conn)
+            try:
+                conn.smtp.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._connect(conn)
+                conn.smtp.send_message(msg)
+            conn.sent += 1
+        except Exception:
+            # Never hand a connection in an unknown state to the next sender
+            conn.close()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def send_report(self, pdf_content, recipient, brand):
+        """
+        Sends a report PDF. Returns (Success: bool, Message: str) like send_email.
+        """
+        try:
+            self.send_message(build_report_message(pdf_content, recipient, brand, self.user))
+            return True, f"Email sent successfully to {recipient}"
+        except Exception as e:
+            return False, str(e)
+
+    def send_reports(self, reports, recipient):
+        """
+        Sends several (brand, location, pdf) reports in one message. Returns (Success: bool, Message: str).
+        """
+        try:
+            self.send_message(build_grouped_message(reports, recipient, self.user))
+            return True, f"Email with {len(reports)} reports sent successfully to {recipient}"
+        except Exception as e:
+            return False, str(e)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,76 +1,270 @@
 import os
-import gspread
+import json
 import pdfkit
-import smtplib
+import hashlib
 import datetime
+import multiprocessing
 import pandas as pd
-import base64
-from jinja2 import Template
-from email.message import EmailMessage
-from oauth2client.service_account import ServiceAccountCredentials
+import queue
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 
-import google.generativeai as genai
+from ai_client import get_gemini_client
+from artifacts import ArtifactCache, get_artifact_cache
+from cache import get_ai_cache
+from history import sparkline_points
+from metrics import fleet_metrics, peer_comparison
+from mailer import MESSAGE_OVERHEAD, Mailer, encoded_size, split_by_size
+from rendering import get_render_context
+from schema import TEXT_FIELDS, column_for, require_columns, resolve_columns
+from sheets import get_sheets_client, open_worksheet, parse_credentials
 
-def get_gemini_analysis(brand, location, orders, error_pct, kpt, mfr_cancellations=0, kitchen_errors=0):
-    """
-    Uses Google Gemini AI to analyze kitchen performance and provide improvement tips.
-    """
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        return "AI Analysis: Gemini API Key not configured. Please set GEMINI_API_KEY."
+# One outlet's outcome from a bulk run. pdf is None and error is set when it failed.
+# cached is True when the PDF was served from the artifact cache instead of being rendered.
+ReportResult = namedtuple("ReportResult", ["brand", "location", "pdf", "manager_email", "error", "cached"], defaults=[False])
 
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        prompt = f"""
-        Analyze the following kitchen performance data for {brand} at {location}:
-        - Total Orders: {orders}
-        - Error Percentage: {error_pct}%
-        - Kitchen Prep Time (KPT): {kpt} minutes
-        - MFR Cancellations: {mfr_cancellations}
-        - Kitchen Errors: {kitchen_errors}
+# One consolidated PDF. outlets lists the (brand, location) pairs it covers; failed lists
+# (brand, location, error) for outlets left out. pdf is None and error is set when it failed.
+BundleResult = namedtuple("BundleResult", ["name", "outlets", "pdf", "failed", "error"])
+
+# One outlet's outcome from a bulk email run. status is 'sent', 'skipped', 'failed', or
+# 'unconfirmed' when a journaled send was cut off mid-flight and is not retried.
+EmailOutcome = namedtuple("EmailOutcome", ["brand", "location", "recipient", "status", "detail"])
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+ANALYSIS_FIELDS = ['brand', 'location', 'orders', 'error_pct', 'kpt', 'mfr_cancellations', 'kitchen_errors']
+
+def _analysis_key(outlet):
+    return [str(outlet.get(f, 0)) for f in ANALYSIS_FIELDS]
+
+def _analysis_prompt(outlet):
+    return f"""
+        Analyze the following kitchen performance data for {outlet['brand']} at {outlet['location']}:
+        - Total Orders: {outlet['orders']}
+        - Error Percentage: {outlet['error_pct']}%
+        - Kitchen Prep Time (KPT): {outlet['kpt']} minutes
+        - MFR Cancellations: {outlet.get('mfr_cancellations', 0)}
+        - Kitchen Errors: {outlet.get('kitchen_errors', 0)}
 
         Provide 3 concise, professional, and actionable recommendations to reduce errors and improve speed.
         Focus on specific issues like cancellations and kitchen-specific errors if they are high.
         Keep the response brief (max 100 words) and formatted as a bulleted list.
         """
-        
-        response = model.generate_content(prompt)
-        return response.text
+
+def _batch_analysis_prompt(outlets):
+    data = [
+        {
+            "id": str(i),
+            "brand": str(o['brand']),
+            "location": str(o['location']),
+            "total_orders": str(o['orders']),
+            "error_percentage": str(o['error_pct']),
+            "kpt_minutes": str(o['kpt']),
+            "mfr_cancellations": str(o.get('mfr_cancellations', 0)),
+            "kitchen_errors": str(o.get('kitchen_errors', 0)),
+        }
+        for i, o in enumerate(outlets, 1)
+    ]
+    return f"""
+        Analyze the following kitchen performance data for each outlet:
+        {json.dumps(data, indent=2)}
+
+        For EACH outlet, provide 3 concise, professional, and actionable recommendations to reduce errors and improve speed.
+        Focus on specific issues like cancellations and kitchen-specific errors if they are high.
+        Keep each outlet's answer brief (max 100 words) and formatted as a bulleted list.
+
+        Respond with ONLY a JSON object mapping every outlet "id" to its recommendations as one string.
+        No markdown fences, no extra keys, no explanations.
+        """
+
+def _parse_batch_analysis(text):
+    """
+    Parses a batched response into {id: recommendations}, dropping entries that are not usable text.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    parsed = {}
+    for key, value in data.items():
+        if isinstance(value, list) and value and all(isinstance(v, str) and v.strip() for v in value):
+            value = "\n".join(f"- {v.strip().lstrip('-* ').strip()}" for v in value)
+        if isinstance(value, str) and value.strip():
+            parsed[str(key).strip()] = value.strip()
+    return parsed
+
+def _analyze_outlet(client, outlet):
+    """
+    Single-outlet analysis with caching. Failures come back as a message, never an exception.
+    """
+    cache = get_ai_cache()
+    try:
+        text = client.generate(_analysis_prompt(outlet))
+        cache.set("analysis", client.model_name, _analysis_key(outlet), value=text)
+        return text
     except Exception as e:
         return f"AI Analysis could not be generated: {str(e)}"
 
-def match_input_with_ai(user_input, valid_options, item_type="Brand"):
+def submit_gemini_analyses(outlets, batch_size=None, client=None):
+    """
+    Analyzes many outlets, packing up to batch_size of them into one prompt (AI_BATCH_SIZE, default 10).
+    outlets are dicts with the ANALYSIS_FIELDS keys. Returns one Future per outlet, in order.
+    Outlets the model drops or mangles in a batched answer are retried individually.
+    """
+    client = client or get_gemini_client()
+    if client is None:
+        return [_completed("AI Analysis: Gemini API Key not configured. Please set GEMINI_API_KEY.") for _ in outlets]
+    if batch_size is None:
+        batch_size = int(os.getenv('AI_BATCH_SIZE', 10))
+    batch_size = max(1, int(batch_size))
+
+    cache = get_ai_cache()
+    futures = []
+    pending = []
+    for outlet in outlets:
+        hit, cached = cache.get("analysis", client.model_name, _analysis_key(outlet))
+        if hit:
+            futures.append(_completed(cached))
+        else:
+            future = Future()
+            futures.append(future)
+            pending.append((future, outlet))
+
+    def run_batch(batch):
+        try:
+            parsed = _parse_batch_analysis(client.generate(_batch_analysis_prompt([o for _, o in batch])))
+        except Exception:
+            parsed = {}
+        for i, (future, outlet) in enumerate(batch, 1):
+            text = parsed.get(str(i))
+            if text:
+                cache.set("analysis", client.model_name, _analysis_key(outlet), value=text)
+                future.set_result(text)
+            else:
+                # Dropped or mangled: retry this outlet on its own
+                retry = client.submit_task(_analyze_outlet, client, outlet)
+                retry.add_done_callback(lambda f, future=future: future.set_result(f.result()))
+
+    def run_single(future, outlet):
+        future.set_result(_analyze_outlet(client, outlet))
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        if len(batch) == 1:
+            client.submit_task(run_single, *batch[0])
+        else:
+            client.submit_task(run_batch, batch)
+    return futures
+
+def submit_gemini_analysis(brand, location, orders, error_pct, kpt, mfr_cancellations=0, kitchen_errors=0, client=None):
+    """
+    Non-blocking form of get_gemini_analysis: returns a Future resolving to the analysis text.
+    Requests share one rate-limited GeminiClient, so many outlets can be analyzed at once.
+    """
+    outlet = dict(brand=brand, location=location, orders=orders, error_pct=error_pct, kpt=kpt,
+                  mfr_cancellations=mfr_cancellations, kitchen_errors=kitchen_errors)
+    return submit_gemini_analyses([outlet], batch_size=1, client=client)[0]
+
+def get_gemini_analysis(brand, location, orders, error_pct, kpt, mfr_cancellations=0, kitchen_errors=0, client=None):
+    """
+    Uses Google Gemini AI to analyze kitchen performance and provide improvement tips.
+    """
+    return submit_gemini_analysis(brand, location, orders, error_pct, kpt, mfr_cancellations, kitchen_errors, client=client).result()
+
+def _padded_trigrams(s):
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def match_input_locally(user_input, valid_options):
+    """
+    Matches user_input against valid_options without any network call.
+    Returns (best_option, confidence) with confidence between 0 and 1.
+    """
+    if not user_input or not valid_options:
+        return user_input, 0.0
+
+    text = str(user_input).strip()
+
+    # Priority 1: Exact Match
+    for option in valid_options:
+        if str(option).strip() == text:
+            return option, 1.0
+
+    # Priority 2: Case-Insensitive Match
+    for option in valid_options:
+        if str(option).strip().lower() == text.lower():
+            return option, 1.0
+
+    # Priority 3: Normalized Match (Remove all spaces, hyphens, etc)
+    norm_input = _normalize(text)
+    if not norm_input:
+        return user_input, 0.0
+    for option in valid_options:
+        if _normalize(option) == norm_input:
+            return option, 0.99
+
+    # Priority 4: Character trigram similarity (Dice coefficient)
+    input_grams = _padded_trigrams(norm_input)
+    best, best_score = user_input, 0.0
+    for option in valid_options:
+        option_grams = _padded_trigrams(_normalize(option))
+        score = 2 * len(input_grams & option_grams) / (len(input_grams) + len(option_grams))
+        if score > best_score:
+            best, best_score = option, score
+    return best, round(best_score, 4)
+
+def match_input_with_ai(user_input, valid_options, item_type="Brand", threshold=None):
     """
-    Forces the AI to pick exactly one valid option from the list provided.
+    Matches user_input to exactly one valid option. A local matcher runs first; the AI
+    is only asked when local confidence is below threshold (MATCH_CONFIDENCE_THRESHOLD, default 0.85).
     """
     if not user_input or not valid_options:
         return user_input
 
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
+    if threshold is None:
+        threshold = float(os.getenv('MATCH_CONFIDENCE_THRESHOLD', 0.85))
+
+    local_match, confidence = match_input_locally(user_input, valid_options)
+    if confidence >= threshold:
+        return local_match
+
+    client = get_gemini_client()
+    if client is None:
         return user_input 
         
+    cache = get_ai_cache()
+    options_key = [str(o) for o in valid_options]
+
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        prompt = f"""
-        You are a data validation expert. 
-        TASK: Match the value "{user_input}" to one item in this list: {valid_options}
+        hit, match = cache.get("match", client.model_name, item_type, str(user_input), options_key)
+        if not hit:
+            prompt = f"""
+            You are a data validation expert. 
+            TASK: Match the value "{user_input}" to one item in this list: {valid_options}
 
-        RULES:
-        1. You MUST pick the most likely item from the provided list.
-        2. Even if it's a partial match or abbreviation, pick the closest one.
-        3. Output ONLY the exact string from the list. No quotes, no explanations.
-        4. If it's impossible to match, only then return the original "{user_input}".
+            RULES:
+            1. You MUST pick the most likely item from the provided list.
+            2. Even if it's a partial match or abbreviation, pick the closest one.
+            3. Output ONLY the exact string from the list. No quotes, no explanations.
+            4. If it's impossible to match, only then return the original "{user_input}".
 
-        MATCH:
-        """
-        
-        response = model.generate_content(prompt)
-        match = response.text.strip().strip('"').strip("'")
+            MATCH:
+            """
+            
+            match = client.generate(prompt).strip().strip('"').strip("'")
+            cache.set("match", client.model_name, item_type, str(user_input), options_key, value=match)
         
         # Priority 1: Exact or Case-Insensitive Match
         for option in valid_options:
@@ -78,14 +272,11 @@ def match_input_with_ai(user_input, valid_options, item_type="Brand"):
                 return option
         
         # Priority 2: Normalized Match (Remove all spaces, hyphens, etc)
-        def normalize(s):
-            return "".join(e for e in str(s).lower() if e.isalnum())
-
-        normalized_user = normalize(user_input)
-        normalized_match = normalize(match)
+        normalized_user = _normalize(user_input)
+        normalized_match = _normalize(match)
         
         for option in valid_options:
-            norm_opt = normalize(option)
+            norm_opt = _normalize(option)
             if normalized_match == norm_opt or normalized_user == norm_opt:
                 return option
 
@@ -98,117 +289,328 @@ def match_input_with_ai(user_input, valid_options, item_type="Brand"):
     except Exception:
         return user_input
 
-def generate_report_from_df(df, brand, location, logo_b64=None, spreadsheet_url=None):
+def _normalize(value):
+    """Lowercase alphanumeric form of a value, used for robust key matching."""
+    return "".join(e for e in str(value).lower() if e.isalnum())
+
+def _normalize_series(series):
     """
-    Renders a PDF report with flexible column finding and robust row matching.
+    _normalize applied to every value, computed once per distinct value so index keys
+    always match lookup keys (accented letters included).
     """
-    # Auto-load logo if none provided and logo.jpg exists
-    if not logo_b64 and os.path.exists("logo.jpg"):
-        try:
-            with open("logo.jpg", "rb") as f:
-                logo_b64 = base64.b64encode(f.read()).decode()
-        except Exception:
-            pass
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Normalize each category once, then expand through the category codes ('' for missing)
+        categories = pd.Series([_normalize(c) for c in series.cat.categories] + [''], dtype=object).to_numpy()
+        return pd.Series(categories[series.cat.codes.to_numpy()], index=series.index)
+    values = series.astype(str)
+    return values.map({v: _normalize(v) for v in values.unique()})
 
-    # 0. Clean the DataFrame
-    df = df.copy().fillna('')
-    df.columns = [str(c).strip() for c in df.columns]
-    
-    # 1. Identify columns dynamically
-    def find_col(possible_names):
-        # Case 1: Exact Match (stripped)
-        for col in df.columns:
-            if col.lower() in [p.lower() for p in possible_names]:
-                return col
-        # Case 2: Partial Match
-        for col in df.columns:
-            for p in possible_names:
-                if p.lower() in col.lower(): return col
-        return None
-
-    brand_col = find_col(['Brand', 'Brand Name', 'Company', 'Restaurant'])
-    loc_col = find_col(['Location', 'Store', 'Outlet', 'City', 'Area'])
-
-    if not brand_col or not loc_col:
-        raise ValueError(f"Could not find Brand or Location columns. Found: {df.columns.tolist()}")
-
-    # 2. AI FUZZY MATCHING
-    all_brands = [str(b).strip() for b in df[brand_col].unique() if str(b).strip()]
-    all_locations = [str(l).strip() for l in df[loc_col].unique() if str(l).strip()]
-    
-    corrected_brand = match_input_with_ai(brand, all_brands, "Brand")
-    corrected_location = match_input_with_ai(location, all_locations, "Location")
-    
+# Cell values treated as missing in numeric columns
+MISSING_VALUES = ['', '-', 'na', 'n/a', 'nan', 'none', 'null']
+
+def to_number(series):
+    """
+    Numeric (float64) form of a metric column. Blanks and MISSING_VALUES become NaN,
+    thousands separators are ignored and anything else unparseable is NaN too.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    text = series.astype(str).str.strip().str.replace(',', '', regex=False)
+    text = text.mask(series.isna() | text.str.lower().isin(MISSING_VALUES))
+    return pd.to_numeric(text, errors='coerce').astype('float64')
+
+def to_category(series):
+    """
+    Categorical form of a text column, with '' for missing values.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if series.isna().any():
+            if '' not in series.cat.categories:
+                series = series.cat.add_categories([''])
+            series = series.fillna('')
+        return series
+    return series.where(series.notna(), '').astype(str).astype('category')
+
+def _number(value, default=0):
+    """
+    A metric cell for display: default when missing, int when whole.
+    """
+    if value is None or pd.isna(value):
+        return default
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+class _SubstringIndex:
+    """
+    Trigram index over a set of normalized keys for fast substring lookups.
+    """
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.grams = {}
+        for key in self.keys:
+            for gram in self._trigrams(key):
+                self.grams.setdefault(gram, set()).add(key)
+
+    @staticmethod
+    def _trigrams(s):
+        return {s[i:i + 3] for i in range(len(s) - 2)}
+
+    def search(self, needle):
+        """
+        Returns the set of keys containing needle.
+        """
+        grams = self._trigrams(needle)
+        if not grams:
+            # Too short to index: scan the distinct keys
+            return {k for k in self.keys if needle in k}
+        candidates = set.intersection(*(self.grams.get(g, set()) for g in grams))
+        return {k for k in candidates if needle in k}
+
+def load_logo_b64(path="logo.jpg"):
+    """
+    Returns the base64-encoded logo, or None if it is missing or unreadable.
+    Encoded (and downscaled) once per process until the file changes.
+    """
+    return get_render_context().logo_b64(path)
+
+class PreparedData:
+    """
+    A compact, typed copy of a DataFrame with its column mapping and normalized
+    brand/location keys. Built once per DataFrame and shared read-only by every report
+    generated from it.
+    """
+
+    def __init__(self, df):
+        # 0. Resolve the column mapping once per header (memoized in schema)
+        source_cols = {}
+        for c in df.columns:
+            source_cols.setdefault(str(c).strip(), c)
+        self.mapping = resolve_columns(source_cols)
+        require_columns(self.mapping)
+
+        # 1. Identify columns dynamically
+        self.brand_col = column_for(self.mapping, 'brand')
+        self.loc_col = column_for(self.mapping, 'location')
+        self.orders_col = column_for(self.mapping, 'orders')
+        self.errors_col = column_for(self.mapping, 'kitchen_errors')
+        self.kpt_col = column_for(self.mapping, 'kpt')
+        self.email_col = column_for(self.mapping, 'manager_email')
+        self.mfr_can_col = column_for(self.mapping, 'mfr_cancellations')
+        self.mfr_err_col = column_for(self.mapping, 'mfr_errors')
+
+        # Compact frame: only the columns reports use, metrics as float64 (NaN = missing)
+        # and text as categoricals with '' for missing. Never modified after this point,
+        # so every report reads it without copying.
+        compact = {}
+        for field, col in self.mapping.columns.items():
+            if col not in compact:
+                convert = to_category if field in TEXT_FIELDS else to_number
+                compact[col] = convert(df[source_cols[col]])
+        df = pd.DataFrame(compact)
+        self.df = df
+
+        # 2. Option lists for AI matching
+        self.all_brands = [str(b).strip() for b in df[self.brand_col].unique() if str(b).strip()]
+        self.all_locations = [str(l).strip() for l in df[self.loc_col].unique() if str(l).strip()]
+
+        # 3. Lookup index: normalized brand -> normalized location -> row positions
+        self.outlet_index = {}
+        self.brand_locations = {}
+        raw_brands = df[self.brand_col].astype(str)
+        raw_locations = df[self.loc_col].astype(str)
+        self.norm_brands = _normalize_series(df[self.brand_col])
+        self.norm_locations = _normalize_series(df[self.loc_col])
+        for pos, (raw_b, raw_l, nb, nl) in enumerate(zip(raw_brands, raw_locations, self.norm_brands, self.norm_locations)):
+            self.outlet_index.setdefault(nb, {}).setdefault(nl, []).append(pos)
+            # Diagnostic: raw locations per brand, in sheet order
+            self.brand_locations.setdefault(raw_b.strip().lower(), {}).setdefault(raw_l)
+        self.brand_locations = {b: list(locs) for b, locs in self.brand_locations.items()}
+
+        self._fleet = None
+
+        # Substring fallback over distinct keys instead of every row
+        self.brand_search = _SubstringIndex(self.outlet_index)
+        self.loc_search = _SubstringIndex({nl for locs in self.outlet_index.values() for nl in locs})
+
+    def outlet_pairs(self):
+        """
+        Returns every distinct non-empty (brand, location) pair in the data, in sheet order.
+        """
+        combinations = self.df[[self.brand_col, self.loc_col]].drop_duplicates().values.tolist()
+        return [(str(b), str(l)) for b, l in combinations if str(b).strip() and str(l).strip()]
+
+    def metric_columns(self):
+        """
+        Maps each TREND_METRICS name to its source column.
+        """
+        return {
+            'orders': self.orders_col,
+            'kpt': self.kpt_col,
+            'kitchen_errors': self.errors_col,
+            'mfr_errors': self.mfr_err_col,
+            'mfr_cancellations': self.mfr_can_col,
+        }
+
+    def metrics_frame(self):
+        """
+        One row per outlet (the first row for each normalized key, as lookups use) with
+        numeric metrics, built in a single vectorized pass.
+        """
+        df = self.df
+        frame = pd.DataFrame({
+            'brand_key': self.norm_brands,
+            'location_key': self.norm_locations,
+            'brand': df[self.brand_col].astype(str).str.strip(),
+            'location': df[self.loc_col].astype(str).str.strip(),
+        })
+        for name, col in self.metric_columns().items():
+            frame[name] = df[col] if col in df.columns else float('nan')
+        frame = frame[(frame['brand_key'] != '') & (frame['location_key'] != '')]
+        return frame.drop_duplicates(['brand_key', 'location_key']).reset_index(drop=True)
+
+    def fleet(self):
+        """
+        fleet_metrics for every outlet as {outlet key: values}, computed once per DataFrame.
+        """
+        if self._fleet is None:
+            self._fleet = fleet_metrics(self.metrics_frame()).to_dict('index')
+        return self._fleet
+
+    def manager_email(self, brand, location):
+        """
+        Manager_Email of an outlet found by its exact normalized key, as _outlet_context
+        reads it, without any fuzzy matching. None if the outlet is not found that way.
+        """
+        positions = self.outlet_index.get(_normalize(brand), {}).get(_normalize(location))
+        if not positions:
+            return None
+        if self.email_col not in self.df.columns:
+            return "No email found"
+        return self.df[self.email_col].iat[min(positions)] or "No email found"
+
+    def row_key(self, row):
+        """
+        Normalized (brand, location) key of a data row.
+        """
+        return _normalize(row[self.brand_col]), _normalize(row[self.loc_col])
+
+    def find_row(self, brand, location):
+        """
+        Resolves a brand/location to its data row.
+        Returns (corrected_brand, corrected_location, row) or raises ValueError.
+        """
+        corrected_brand = match_input_with_ai(brand, self.all_brands, "Brand")
+        corrected_location = match_input_with_ai(location, self.all_locations, "Location")
+
+        norm_brand = _normalize(corrected_brand)
+        norm_loc = _normalize(corrected_location)
+
+        positions = self.outlet_index.get(norm_brand, {}).get(norm_loc)
+
+        # Try 2: Substring Match if Try 1 fails
+        if not positions:
+            loc_matches = self.loc_search.search(norm_loc)
+            positions = [
+                pos
+                for nb in self.brand_search.search(norm_brand)
+                for nl, rows in self.outlet_index[nb].items() if nl in loc_matches
+                for pos in rows
+            ]
+
+        if not positions:
+            # Diagnostic: Show available combinations for this brand
+            avail_locs = self.brand_locations.get(str(corrected_brand).strip().lower(), [])
+
+            err_msg = f"No record found for '{corrected_brand}' at '{corrected_location}'."
+            if avail_locs:
+                err_msg += f" Available locations for this brand: {avail_locs}"
+            else:
+                err_msg += f" Brand not found in data. Found: {self.all_brands[:5]}..."
+
+            raise ValueError(err_msg)
+
+        return corrected_brand, corrected_location, self.df.iloc[min(positions)]
+
+def prepare_data(df):
+    """
+    Returns a PreparedData for df. Already-prepared data is passed through unchanged.
+    """
+    if isinstance(df, PreparedData):
+        return df
+    return PreparedData(df)
+
+TREND_LABELS = {
+    'orders': 'Total Orders',
+    'kpt': 'Avg Prep Time',
+    'kitchen_errors': 'Kitchen Errors',
+    'mfr_errors': 'System Exceptions',
+    'mfr_cancellations': 'MFR Cancellations',
+}
+
+def _trend_rows(trend):
+    """
+    Template rows for the week-over-week section, or [] when there is no earlier week.
+    """
+    if not trend:
+        return []
+    rows = []
+    for metric, label in TREND_LABELS.items():
+        delta = trend.get(f"{metric}_delta")
+        series = trend.get(f"{metric}_series") or []
+        if delta is None or delta != delta:
+            continue
+        # More orders is good; for everything else lower is better
+        improved = delta > 0 if metric == 'orders' else delta < 0
+        rows.append(dict(
+            label=label,
+            delta=int(delta) if float(delta).is_integer() else round(delta, 2),
+            improved=improved,
+            points=sparkline_points(series),
+        ))
+    return rows
+
+def load_trends(prepared, history, weeks=8):
+    """
+    Returns {outlet key: trend values} for every outlet from one batched query, comparing
+    this data with the weeks recorded in history. Nothing is recorded; see record_metrics.
+    """
+    return history.trends(prepared.metrics_frame(), weeks=weeks).to_dict('index')
+
+def record_metrics(df, history, week=None):
+    """
+    Stores every outlet's metrics in history for week (default: the current ISO week).
+    Call it only for freshly ingested data, never for previews or snapshot backfills.
+    """
+    history.record(prepare_data(df).metrics_frame(), week=week)
+
+def _outlet_context(prepared, brand, location, spreadsheet_url=None, trends=None):
+    """
+    Looks up a single outlet and returns (template_values, manager_email).
+    trends is the output of load_trends, if week-over-week data is wanted.
+    """
     # 3. ROBUST FILTERING
-    def normalize_series(series):
-        return series.astype(str).str.lower().str.replace(r'[^a-zA-Z0-9]', '', regex=True)
+    corrected_brand, corrected_location, row = prepared.find_row(brand, location)
 
-    norm_brand = "".join(e for e in str(corrected_brand).lower() if e.isalnum())
-    norm_loc = "".join(e for e in str(corrected_location).lower() if e.isalnum())
+    # 4. READ METRICS
+    orders = _number(row.get(prepared.orders_col))
+    errors = _number(row.get(prepared.errors_col))
+    kpt = _number(row.get(prepared.kpt_col))
+    manager_email = row.get(prepared.email_col, "No email found") or "No email found"
 
-    mask = (
-        (normalize_series(df[brand_col]) == norm_brand) & 
-        (normalize_series(df[loc_col]) == norm_loc)
-    )
-    filtered_df = df[mask]
-    
-    # Try 2: Substring Match if Try 1 fails
-    if filtered_df.empty:
-        mask = (
-            (df[brand_col].astype(str).str.lower().str.contains(str(corrected_brand).lower(), na=False)) |
-            (normalize_series(df[brand_col]).str.contains(norm_brand, na=False))
-        ) & (
-            (df[loc_col].astype(str).str.lower().str.contains(str(corrected_location).lower(), na=False)) |
-            (normalize_series(df[loc_col]).str.contains(norm_loc, na=False))
-        )
-        filtered_df = df[mask]
-
-    if filtered_df.empty:
-        # Diagnostic: Show available combinations for this brand
-        same_brand = df[df[brand_col].astype(str).str.strip().str.lower() == str(corrected_brand).strip().lower()]
-        avail_locs = same_brand[loc_col].unique().tolist() if not same_brand.empty else []
-        
-        err_msg = f"No record found for '{corrected_brand}' at '{corrected_location}'."
-        if avail_locs:
-            err_msg += f" Available locations for this brand: {avail_locs}"
-        else:
-            err_msg += f" Brand not found in data. Found: {all_brands[:5]}..."
-            
-        raise ValueError(err_msg)
-        
-    row = filtered_df.iloc[0]
-    
-    # 4. GET AI ANALYSIS
-    # Find Orders, Errors, KPT columns dynamically
-    orders_col = find_col(['Orders', 'Total Orders']) or 'Orders'
-    errors_col = find_col(['Kitchen Errors', 'K-Errors', 'Kitchen Error', 'Errors', 'Total Errors', 'CSR Errors']) or 'Kitchen Errors'
-    kpt_col = find_col(['KPT', 'Prep Time', 'Kitchen Prep Time']) or 'KPT'
-    email_col = find_col(['Manager_Email', 'Email', 'Manager Email']) or 'Manager_Email'
-    
-    # New Fields
-    mfr_can_col = find_col(['MFR Cancellations', 'Cancellations', 'MFR Can']) or 'MFR Cancellations'
-    mfr_err_col = find_col(['MFR Error', 'MFR Errors', 'MFR-Err']) or 'MFR Errors'
-
-    orders = row.get(orders_col, 0) or 0
-    errors = row.get(errors_col, 0) or 0
-    kpt = row.get(kpt_col, 0) or 0
-    manager_email = row.get(email_col, "No email found") or "No email found"
-    
-    mfr_cancellations = row.get(mfr_can_col, 0) or 0
-    mfr_errors = row.get(mfr_err_col, 0) or 0
+    mfr_cancellations = _number(row.get(prepared.mfr_can_col))
+    mfr_errors = _number(row.get(prepared.mfr_err_col))
     kitchen_errors = errors 
 
     # Dynamic Spreadsheet URL: Priority 1: Specific row source, Priority 2: Fallback
     final_spreadsheet_url = str(row.get('Source_URL', '')).strip() or str(spreadsheet_url or '').strip()
     
-    error_pct = round((float(errors)/float(orders))*100, 2) if float(orders) > 0 else 0
+    # Derived metrics come precomputed for the whole fleet
+    fleet_row = prepared.fleet().get(prepared.row_key(row), {})
+    error_pct = _number(fleet_row.get('error_pct'))
     k_error_pct = error_pct 
-    
-    # 5. RENDER PDF
-    with open("template.html", "r", encoding="utf-8") as f:
-        tmpl = Template(f.read())
-    
-    html_out = tmpl.render(
+
+    context = dict(
         brand=corrected_brand, 
         location=corrected_location, 
         orders=orders,
@@ -218,51 +620,493 @@ def generate_report_from_df(df, brand, location, logo_b64=None, spreadsheet_url=
         kitchen_errors=kitchen_errors,
         mfr_errors=mfr_errors,
         k_error_pct=k_error_pct,
-        logo_b64=logo_b64,
         spreadsheet_url=final_spreadsheet_url,
-        published_at=(datetime.datetime.utcnow() + datetime.timedelta(hours=5, minutes=30)).strftime("%B %d, %Y // %I:%M %p IST")
+        trends=_trend_rows(trends.get(prepared.row_key(row))) if trends else [],
+        peers=peer_comparison(fleet_row)
     )
-    
-    # Path detection for wkhtmltopdf
-    config = None
-    import shutil
-    
-    system_path = shutil.which("wkhtmltopdf")
-    if system_path:
-        config = pdfkit.configuration(wkhtmltopdf=system_path)
-    else:
-        # Fallback to common hardcoded paths
-        possible_paths = [
-            r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe',
-            r'C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe',
-            r'/usr/bin/wkhtmltopdf',
-            r'/usr/local/bin/wkhtmltopdf'
-        ]
-        for path in possible_paths:
-            if os.path.exists(path):
-                config = pdfkit.configuration(wkhtmltopdf=path)
-                break
-            
-    options = {
-        'page-size': 'A4',
-        'margin-top': '0in',
-        'margin-right': '0in',
-        'margin-bottom': '0in',
-        'margin-left': '0in',
-        'encoding': "UTF-8",
-        'enable-local-file-access': None,
-        'enable-external-links': None, # Critical for links to work
-        'no-outline': None,
-        'quiet': ''
-    }
-    
+    return context, manager_email
+
+def _render_html(context, logo_b64=None, ai_analysis=None):
+    """
+    Renders report HTML from an outlet context.
+    """
+    # 5. RENDER HTML
+    tmpl = get_render_context().template()
+
+    return tmpl.render(
+        **context,
+        logo_b64=logo_b64,
+        ai_analysis=ai_analysis,
+        published_at=_published_at()
+    )
+
+def _published_at():
+    return (datetime.datetime.utcnow() + datetime.timedelta(hours=5, minutes=30)).strftime("%B %d, %Y // %I:%M %p IST")
+
+def _render_contents(title, contexts, logo_b64=None):
+    """
+    Renders the contents page that opens a consolidated PDF.
+    """
+    return get_render_context().template("contents.html").render(
+        title=title, outlets=contexts, logo_b64=logo_b64, published_at=_published_at()
+    )
+
+PDF_OPTIONS = {
+    'page-size': 'A4',
+    'margin-top': '0in',
+    'margin-right': '0in',
+    'margin-bottom': '0in',
+    'margin-left': '0in',
+    'encoding': "UTF-8",
+    'enable-local-file-access': None,
+    'enable-external-links': None, # Critical for links to work
+    'no-outline': None,
+    'quiet': ''
+}
+
+def _pool_context():
+    """
+    Start method for PDF worker processes (PDF_WORKER_START_METHOD): forkserver where the
+    OS has it, else spawn. Plain fork from a process whose other threads (background jobs,
+    Streamlit sessions) may hold a lock would copy that lock into the worker still locked.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    method = os.getenv('PDF_WORKER_START_METHOD') or ("forkserver" if "forkserver" in methods else "spawn")
+    return multiprocessing.get_context(method)
+
+def html_to_pdf(html_out):
+    """
+    Converts rendered report HTML to PDF bytes with wkhtmltopdf.
+    Module-level so it can run in a worker process.
+    """
+    config = get_render_context().pdfkit_config()
+
     try:
-        pdf = pdfkit.from_string(html_out, False, configuration=config, options=options)
+        pdf = pdfkit.from_string(html_out, False, configuration=config, options=PDF_OPTIONS)
     except Exception as e:
         if "No wkhtmltopdf executable found" in str(e):
             raise RuntimeError("PDF Error: wkhtmltopdf not found.")
         raise e
         
+    return pdf
+
+def htmls_to_pdf(html_pages):
+    """
+    Converts several rendered pages to one PDF with a single wkhtmltopdf run.
+    Each page is a separate input, so each starts on a new sheet.
+    Module-level so it can run in a worker process.
+    """
+    config = get_render_context().pdfkit_config()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i, html_out in enumerate(html_pages):
+            path = os.path.join(folder, f"page-{i:05d}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(html_out)
+            paths.append(path)
+        try:
+            return pdfkit.from_file(paths, False, configuration=config, options=PDF_OPTIONS)
+        except Exception as e:
+            if "No wkhtmltopdf executable found" in str(e):
+                raise RuntimeError("PDF Error: wkhtmltopdf not found.")
+            raise e
+
+def _artifact_key(context, logo_b64=None, ai_analysis=None):
+    """
+    Content address of a report PDF: its template values, AI text, template and logo.
+    published_at is left out, so a reused PDF shows when it was first rendered.
+    """
+    logo_hash = hashlib.sha256((logo_b64 or "").encode()).hexdigest()
+    return ArtifactCache.make_key(context, ai_analysis, get_render_context().template_hash(), logo_hash)
+
+def _render_report(prepared, brand, location, logo_b64=None, spreadsheet_url=None, include_ai=False, trends=None, use_cache=True):
+    """
+    Renders the PDF for a single outlet from prepared data, or serves it from the artifact
+    cache when nothing that goes into it changed. Returns (pdf, manager_email).
+    """
+    context, manager_email = _outlet_context(prepared, brand, location, spreadsheet_url=spreadsheet_url, trends=trends)
+    ai_analysis = submit_gemini_analyses([context], batch_size=1)[0].result() if include_ai else None
+    artifacts = get_artifact_cache() if use_cache else None
+    key = _artifact_key(context, logo_b64, ai_analysis) if artifacts else None
+    pdf = artifacts.get(key) if artifacts else None
+    if pdf is None:
+        pdf = html_to_pdf(_render_html(context, logo_b64=logo_b64, ai_analysis=ai_analysis))
+        if artifacts:
+            artifacts.set(key, pdf)
+    return pdf, manager_email
+
+def generate_reports_from_df(df, pairs=None, logo_b64=None, spreadsheet_url=None, include_ai=False, history=None, use_cache=True):
+    """
+    Batch API: prepares the DataFrame once, then yields (brand, location, pdf, manager_email)
+    for each requested pair. Defaults to every outlet in the data.
+    include_ai adds Gemini recommendations to each report; a MetricsHistory as history
+    adds week-over-week trends. use_cache=False always renders.
+    """
+    prepared = prepare_data(df)
+    trends = load_trends(prepared, history) if history is not None else None
+
+    # Auto-load logo if none provided and logo.jpg exists
+    if not logo_b64:
+        logo_b64 = load_logo_b64()
+
+    if pairs is None:
+        pairs = prepared.outlet_pairs()
+
+    for brand, location in pairs:
+        pdf, manager_email = _render_report(prepared, brand, location, logo_b64=logo_b64, spreadsheet_url=spreadsheet_url, include_ai=include_ai, trends=trends, use_cache=use_cache)
+        yield brand, location, pdf, manager_email
+
+def _outlet_contexts(prepared, pairs, spreadsheet_url=None, trends=None, include_ai=False, ai_batch_size=None):
+    """
+    Data lookup for every outlet up front, so AI requests start immediately.
+    Returns (outlets, errors): outlets[i] is (context, manager_email, analysis future or None)
+    or None when the lookup failed, in which case errors[i] holds the reason.
+    """
+    outlets = [None] * len(pairs)
+    errors = [None] * len(pairs)
+    for i, (brand, location) in enumerate(pairs):
+        try:
+            context, manager_email = _outlet_context(prepared, brand, location, spreadsheet_url=spreadsheet_url, trends=trends)
+            outlets[i] = (context, manager_email, None)
+        except Exception as e:
+            errors[i] = str(e)
+
+    if include_ai:
+        found = [i for i in range(len(pairs)) if outlets[i] is not None]
+        analyses = submit_gemini_analyses([outlets[i][0] for i in found], batch_size=ai_batch_size)
+        for i, analysis in zip(found, analyses):
+            outlets[i] = outlets[i][:2] + (analysis,)
+    return outlets, errors
+
+def generate_reports_parallel(df, pairs=None, workers=None, logo_b64=None, spreadsheet_url=None, on_progress=None, include_ai=False, ai_batch_size=None, history=None, use_cache=True):
+    """
+    Bulk API: looks up and templates each outlet on this process, then converts the HTML
+    to PDF on a pool of worker processes. Yields ReportResult in the order of pairs;
+    a failed outlet carries its error instead of stopping the run.
+    on_progress(done, total) is called from this thread as each PDF finishes.
+    With include_ai, every outlet's analysis is requested up front, ai_batch_size outlets
+    per prompt, so AI latency overlaps PDF rendering. A MetricsHistory as history adds
+    week-over-week trends, queried once for the whole batch (record_metrics stores a week).
+    Outlets whose inputs are unchanged since an earlier run come from the artifact cache
+    (ReportResult.cached) unless use_cache is False.
+    """
+    prepared = prepare_data(df)
+    trends = load_trends(prepared, history) if history is not None else None
+    if not logo_b64:
+        logo_b64 = load_logo_b64()
+    if pairs is None:
+        pairs = prepared.outlet_pairs()
+    pairs = list(pairs)
+    total = len(pairs)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    results = [None] * total
+    done_count = 0
+
+    def finish(i, pdf, manager_email, error, cached=False):
+        nonlocal done_count
+        brand, location = pairs[i]
+        results[i] = ReportResult(brand, location, pdf, manager_email, error, cached)
+        done_count += 1
+        if on_progress: on_progress(done_count, total)
+
+    outlets, errors = _outlet_contexts(prepared, pairs, spreadsheet_url=spreadsheet_url, trends=trends,
+                                       include_ai=include_ai, ai_batch_size=ai_batch_size)
+    for i, error in enumerate(errors):
+        if error is not None:
+            finish(i, None, None, error)
+
+    artifacts = get_artifact_cache() if use_cache else None
+    in_flight = {}
+    next_index = 0
+    next_yield = 0
+    window = workers * 2
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        while next_yield < total:
+            # Keep the pool busy without holding every outlet's HTML (or cached PDF) in memory
+            while next_index < total and len(in_flight) < window and next_index - next_yield < window * 2:
+                if outlets[next_index] is not None:
+                    context, manager_email, analysis = outlets[next_index]
+                    outlets[next_index] = None
+                    try:
+                        ai_analysis = analysis.result() if analysis else None
+                        key = _artifact_key(context, logo_b64, ai_analysis) if artifacts else None
+                        pdf = artifacts.get(key) if artifacts else None
+                        if pdf is not None:
+                            finish(next_index, pdf, manager_email, None, cached=True)
+                        else:
+                            html_out = _render_html(context, logo_b64=logo_b64, ai_analysis=ai_analysis)
+                            in_flight[pool.submit(html_to_pdf, html_out)] = (next_index, manager_email, key)
+                    except Exception as e:
+                        finish(next_index, None, manager_email, str(e))
+                next_index += 1
+
+            if in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i, manager_email, key = in_flight.pop(future)
+                    try:
+                        pdf = future.result()
+                    except Exception as e:
+                        finish(i, None, manager_email, str(e))
+                        continue
+                    if artifacts:
+                        artifacts.set(key, pdf)
+                    finish(i, pdf, manager_email, None)
+
+            # Release every result that is next in order
+            while next_yield < total and results[next_yield] is not None:
+                yield results[next_yield]
+                results[next_yield] = None
+                next_yield += 1
+
+def generate_consolidated_reports(df, pairs=None, mode="brand", workers=None, logo_b64=None, spreadsheet_url=None,
+                                  on_progress=None, include_ai=False, ai_batch_size=None, history=None):
+    """
+    Consolidated API: one multi-page PDF per brand (mode="brand") or one for the whole
+    fleet (mode="fleet"). Each document opens with a contents page followed by every
+    outlet's report, and is converted with a single wkhtmltopdf run; documents convert
+    in parallel on worker processes. Yields BundleResult in order of first appearance.
+    on_progress(done, total) counts documents. Other options are as for generate_reports_parallel.
+    """
+    if mode not in ("brand", "fleet"):
+        raise ValueError(f"mode must be 'brand' or 'fleet', not {mode!r}")
+    prepared = prepare_data(df)
+    trends = load_trends(prepared, history) if history is not None else None
+    if not logo_b64:
+        logo_b64 = load_logo_b64()
+    if pairs is None:
+        pairs = prepared.outlet_pairs()
+    pairs = list(pairs)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    outlets, errors = _outlet_contexts(prepared, pairs, spreadsheet_url=spreadsheet_url, trends=trends,
+                                       include_ai=include_ai, ai_batch_size=ai_batch_size)
+
+    # Group outlets into documents, keeping the order of pairs
+    bundles = {}
+    for i, (brand, location) in enumerate(pairs):
+        name = "Fleet" if mode == "fleet" else (outlets[i][0]['brand'] if outlets[i] else brand)
+        bundles.setdefault(name, []).append(i)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=min(workers, max(1, len(bundles))), mp_context=_pool_context()) as pool:
+        for name, members in bundles.items():
+            included, failed, pages = [], [], []
+            for i in members:
+                brand, location = pairs[i]
+                if outlets[i] is None:
+                    failed.append((brand, location, errors[i]))
+                    continue
+                context, _, analysis = outlets[i]
+                try:
+                    ai_analysis = analysis.result() if analysis else None
+                    pages.append((context, _render_html(context, logo_b64=logo_b64, ai_analysis=ai_analysis)))
+                    included.append((brand, location))
+                except Exception as e:
+                    failed.append((brand, location, str(e)))
+            if not pages:
+                results.append((name, included, failed, None))
+                continue
+            title = "Fleet Report" if mode == "fleet" else f"{name} Report"
+            html_pages = [_render_contents(title, [c for c, _ in pages], logo_b64=logo_b64)] + [h for _, h in pages]
+            results.append((name, included, failed, pool.submit(htmls_to_pdf, html_pages)))
+
+        total = len(results)
+        for done, (name, included, failed, future) in enumerate(results, 1):
+            if future is None:
+                result = BundleResult(name, included, None, failed, "No outlets could be rendered")
+            else:
+                try:
+                    result = BundleResult(name, included, future.result(), failed, None)
+                except Exception as e:
+                    result = BundleResult(name, included, None, failed, str(e))
+            if on_progress: on_progress(done, total)
+            yield result
+
+def _valid_email(value):
+    return bool(value) and "@" in str(value)
+
+def email_reports(df, pairs=None, render_workers=None, send_workers=2, spreadsheet_url=None,
+                  include_ai=False, mailer=None, queue_size=None, on_progress=None,
+                  group_by_recipient=False, max_message_bytes=None, history=None, use_cache=True,
+                  journal=None, run_id=None, cancel=None):
+    """
+    Bulk email pipeline: PDFs render on a process pool while sender threads mail finished
+    reports through a bounded queue, so total time approaches the slower of the two stages.
+    Returns one EmailOutcome per outlet, in the order of pairs, with status
+    'sent', 'skipped' (no valid Manager_Email) or 'failed' and the reason in detail.
+    on_progress(done, total) is called from this thread.
+
+    With group_by_recipient, every report addressed to the same Manager_Email goes out in
+    one message, split into several so no message exceeds max_message_bytes once its
+    attachments are base64-encoded (EMAIL_MAX_MESSAGE_MB, default 18).
+
+    With a RunJournal, every outlet's state is recorded under run_id (a new run is started
+    if none is given), and each delivery is claimed first so no outlet is mailed twice to
+    the same manager within the run. To resume, pass the same run_id: pairs then default
+    to the run's unfinished outlets. An outlet whose send was cut off by a crash ends as
+    'unconfirmed' (it may have been delivered) instead of being sent again.
+
+    Once the threading.Event cancel is set, no further outlets are queued: messages already
+    queued still go out, the rest stay unfinished in the journal, and only the outcomes of
+    outlets that were processed are returned.
+    """
+    prepared = prepare_data(df)
+    if pairs is None:
+        pairs = journal.pending(run_id) if journal is not None and run_id else prepared.outlet_pairs()
+    pairs = list(pairs)
+    if journal is not None and not run_id:
+        run_id = journal.start_run('email', pairs)
+    total = len(pairs)
+    send_workers = max(1, int(send_workers))
+    if max_message_bytes is None:
+        max_message_bytes = float(os.getenv('EMAIL_MAX_MESSAGE_MB', 18)) * 1024 * 1024
+
+    own_mailer = mailer is None
+    if own_mailer:
+        mailer = Mailer(pool_size=send_workers)
+
+    outcomes = [None] * total
+    to_send = queue.Queue(maxsize=queue_size or send_workers * 2)
+    finished = queue.Queue()
+    done_count = 0
+
+    def record(i, outcome):
+        nonlocal done_count
+        outcomes[i] = outcome
+        if journal is not None:
+            journal.mark(run_id, outcome.brand, outcome.location, outcome.status, recipient=outcome.recipient, detail=outcome.detail)
+        done_count += 1
+        if on_progress: on_progress(done_count, total)
+
+    def drain(block=False):
+        while True:
+            try:
+                i, outcome = finished.get(timeout=0.1) if block else finished.get_nowait()
+            except queue.Empty:
+                return
+            record(i, outcome)
+            block = False
+
+    def sender():
+        while True:
+            item = to_send.get()
+            if item is None:
+                return
+            recipient, batch = item
+            if journal is not None:
+                batch = claim(recipient, batch)
+                if not batch:
+                    continue
+            if len(batch) == 1:
+                _, result = batch[0]
+                success, msg = mailer.send_report(result.pdf, recipient, result.brand)
+            else:
+                success, msg = mailer.send_reports([(r.brand, r.location, r.pdf) for _, r in batch], recipient)
+            if journal is not None:
+                journal.complete(run_id, recipient, [(r.brand, r.location) for _, r in batch], success)
+            status = 'sent' if success else 'failed'
+            for i, result in batch:
+                finished.put((i, EmailOutcome(result.brand, result.location, recipient, status, msg)))
+
+    def claim(recipient, batch):
+        # Idempotency: only outlets not already (or possibly) delivered in this run go out
+        earlier = journal.claim(run_id, recipient, [(r.brand, r.location) for _, r in batch])
+        fresh = []
+        for i, result in batch:
+            state = earlier[(result.brand, result.location)]
+            if state is None:
+                fresh.append((i, result))
+            elif state == 'sent':
+                finished.put((i, EmailOutcome(result.brand, result.location, recipient, 'sent', "Already sent in this run")))
+            else:
+                finished.put((i, EmailOutcome(result.brand, result.location, recipient, 'unconfirmed',
+                                              "Send was interrupted in an earlier attempt and may have been delivered; not re-sent")))
+        return fresh
+
+    def enqueue(recipient, batch):
+        # Backpressure: wait for a free slot, reporting sends that finish meanwhile
+        while True:
+            try:
+                to_send.put((recipient, batch), timeout=0.1)
+                return
+            except queue.Full:
+                drain()
+
+    # Grouping: reports held per recipient until all of that recipient's outlets are rendered
+    groups = {}
+    expected = {}
+    if group_by_recipient:
+        for brand, location in pairs:
+            manager_email = prepared.manager_email(brand, location)
+            if manager_email is not None:
+                expected[manager_email] = expected.get(manager_email, 0) + 1
+
+    def flush(recipient):
+        budget = max_message_bytes - MESSAGE_OVERHEAD
+        for chunk in split_by_size(groups.pop(recipient), budget, size=lambda item: encoded_size(item[1].pdf)):
+            enqueue(recipient, chunk)
+
+    threads = [threading.Thread(target=sender, daemon=True) for _ in range(send_workers)]
+    for t in threads:
+        t.start()
+
+    reports = None
+    try:
+        reports = generate_reports_parallel(prepared, pairs, workers=render_workers, spreadsheet_url=spreadsheet_url, include_ai=include_ai, history=history, use_cache=use_cache)
+        for i, result in enumerate(reports):
+            if cancel is not None and cancel.is_set():
+                break
+            recipient = result.manager_email
+            if journal is not None and not result.error and _valid_email(recipient):
+                journal.mark(run_id, result.brand, result.location, 'rendered', recipient=recipient)
+            if result.error:
+                record(i, EmailOutcome(result.brand, result.location, recipient, 'failed', result.error))
+            elif not _valid_email(recipient):
+                record(i, EmailOutcome(result.brand, result.location, recipient, 'skipped', f"Invalid email address: {recipient}"))
+            elif group_by_recipient:
+                groups.setdefault(recipient, []).append((i, result))
+                if len(groups[recipient]) >= expected.get(recipient, 0):
+                    flush(recipient)
+            else:
+                enqueue(recipient, [(i, result)])
+
+            # A recipient with a failed outlet would otherwise wait for it forever
+            if group_by_recipient and (result.error or not _valid_email(recipient)) and recipient in expected:
+                expected[recipient] -= 1
+                if recipient in groups and len(groups[recipient]) >= expected[recipient]:
+                    flush(recipient)
+            drain()
+
+        if cancel is None or not cancel.is_set():
+            for recipient in list(groups):
+                flush(recipient)
+    finally:
+        if reports is not None:
+            # Stops rendering; only PDFs already in flight are waited for
+            reports.close()
+        for _ in threads:
+            to_send.put(None)
+        while any(t.is_alive() for t in threads) or not finished.empty():
+            drain(block=True)
+        if own_mailer:
+            mailer.close()
+        if journal is not None:
+            journal.finish_run(run_id)
+
+    if cancel is not None and cancel.is_set():
+        return [o for o in outcomes if o is not None]
+    return outcomes
+
+def generate_report_from_df(df, brand, location, logo_b64=None, spreadsheet_url=None, include_ai=False, history=None):
+    """
+    Renders a PDF report with flexible column finding and robust row matching.
+    Accepts a raw DataFrame or PreparedData from prepare_data().
+    """
+    _, _, pdf, manager_email = next(generate_reports_from_df(df, [(brand, location)], logo_b64=logo_b64, spreadsheet_url=spreadsheet_url, include_ai=include_ai, history=history))
     return pdf, manager_email
 
 def generate_report(brand, location, creds_dict, sheet_identifier=None, logo_b64=None):
@@ -270,27 +1114,16 @@ def generate_report(brand, location, creds_dict, sheet_identifier=None, logo_b64
     Fetches data from Google Sheets and calls generate_report_from_df.
     Supports Name, URL, or from secrets identifier.
     """
-    # Cloud Resiliency: Handle potential string-pasting issues
-    if isinstance(creds_dict, str):
-        try:
-            clean_json = creds_dict.replace('\\\\', '\\')
-            creds_dict = json.loads(clean_json)
-        except Exception as e:
-            raise ValueError(f"Failed to parse Credentials JSON. Error: {e}")
+    creds_dict = parse_credentials(creds_dict)
 
     # Use sheet_identifier if provided, else check for spreadsheet key in dictionary (Common in st.connection)
     if not sheet_identifier:
         sheet_identifier = creds_dict.get('spreadsheet', "Kitchen_Data")
 
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
+    client = get_sheets_client(creds_dict)
     
     try:
-        if "docs.google.com/spreadsheets" in str(sheet_identifier):
-            sheet = client.open_by_url(sheet_identifier).get_worksheet(0)
-        else:
-            sheet = client.open(sheet_identifier).get_worksheet(0)
+        sheet = open_worksheet(client, sheet_identifier)
     except Exception as e:
         raise ValueError(f"Could not open spreadsheet '{sheet_identifier}'. Error: {e}")
             
@@ -298,11 +1131,15 @@ def generate_report(brand, location, creds_dict, sheet_identifier=None, logo_b64
     
     return generate_report_from_df(df, brand, location, logo_b64=logo_b64)
 
-def send_email(pdf_content, recipient, brand):
+def send_email(pdf_content, recipient, brand, mailer=None):
     """
     Sends the generated PDF as an attachment via Gmail SMTP.
+    Pass a Mailer to reuse its open connection across many sends.
     Returns (Success: bool, Message: str)
     """
+    if mailer is not None:
+        return mailer.send_report(pdf_content, recipient, brand)
+
     try:
         smtp_user = os.getenv('EMAIL_USER')
         smtp_pass = os.getenv('EMAIL_PASS')
@@ -310,23 +1147,7 @@ def send_email(pdf_content, recipient, brand):
         if not smtp_user or not smtp_pass:
             return False, "EMAIL_USER or EMAIL_PASS not set."
 
-        msg = EmailMessage()
-        msg['Subject'] = f"Weekly Performance Report: {brand}"
-        msg['From'] = smtp_user
-        msg['To'] = recipient
-        msg.set_content(f"Hello,\n\nPlease find the attached performance report for {brand}.\n\nGenerated by Kytchens Intelligence.")
-        
-        msg.add_attachment(
-            pdf_content, 
-            maintype='application', 
-            subtype='pdf', 
-            filename=f"{brand}_Report_{datetime.date.today()}.pdf"
-        )
-
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(smtp_user, smtp_pass)
-            smtp.send_message(msg)
-        
-        return True, f"Email sent successfully to {recipient}"
+        with Mailer(smtp_user, smtp_pass) as one_shot:
+            return one_shot.send_report(pdf_content, recipient, brand)
     except Exception as e:
         return False, str(e)
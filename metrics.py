@@ -0,0 +1,68 @@
+import numpy as np
+
+def _rate(numerator, denominator):
+    """
+    numerator / denominator as a percentage rounded to 2 places; 0 where there are no orders.
+    """
+    rate = (numerator.fillna(0) / denominator.where(denominator > 0)) * 100
+    return rate.round(2).fillna(0)
+
+def fleet_metrics(frame):
+    """
+    Derived metrics for every outlet in one vectorized pass over a metrics frame
+    (PreparedData.metrics_frame). Adds:
+      error_pct, cancellation_rate        per-outlet rates
+      kpt_percentile                      share of the fleet with a KPT at or below this outlet's
+      brand_avg_error_pct, brand_avg_kpt, brand_avg_orders
+      brand_rank, brand_size              rank by error % within the brand (1 = fewest errors)
+      fleet_rank, fleet_size              rank by error % across the fleet
+    Ranks, percentiles and averages only cover outlets with orders: one without any has
+    NaN ranks and percentile instead of a 0% error rate that would put it first.
+    Returns it indexed by (brand_key, location_key).
+    """
+    out = frame.copy()
+    orders = out['orders']
+    out['error_pct'] = _rate(out['kitchen_errors'], orders)
+    out['cancellation_rate'] = _rate(out['mfr_cancellations'], orders)
+
+    has_orders = orders > 0
+    ranked = out['error_pct'].where(has_orders)
+    kpt = out['kpt'].where(has_orders)
+    out['kpt_percentile'] = (kpt.rank(pct=True, method='max') * 100).round(0)
+
+    brand_keys = out['brand_key']
+    out['brand_avg_error_pct'] = ranked.groupby(brand_keys, sort=False).transform('mean').round(2)
+    out['brand_avg_kpt'] = kpt.groupby(brand_keys, sort=False).transform('mean').round(1)
+    out['brand_avg_orders'] = orders.where(has_orders).groupby(brand_keys, sort=False).transform('mean').round(0)
+    out['brand_rank'] = ranked.groupby(brand_keys, sort=False).rank(method='min')
+    out['brand_size'] = ranked.groupby(brand_keys, sort=False).transform('count')
+    out['fleet_rank'] = ranked.rank(method='min')
+    out['fleet_size'] = ranked.count()
+
+    return out.set_index(['brand_key', 'location_key'])
+
+def peer_comparison(fleet_row):
+    """
+    Template values for the peer benchmark section from one fleet_metrics row (a dict),
+    or None when the outlet has no peers. Ranks are None for an outlet without orders.
+    """
+    if not fleet_row or fleet_row.get('fleet_size', 0) < 2:
+        return None
+
+    def clean(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        return int(value) if float(value).is_integer() else value
+
+    kpt_percentile = clean(fleet_row.get('kpt_percentile'))
+    return dict(
+        brand_rank=clean(fleet_row['brand_rank']),
+        brand_size=clean(fleet_row['brand_size']),
+        fleet_rank=clean(fleet_row['fleet_rank']),
+        fleet_size=clean(fleet_row['fleet_size']),
+        brand_avg_error_pct=clean(fleet_row['brand_avg_error_pct']),
+        brand_avg_kpt=clean(fleet_row['brand_avg_kpt']),
+        cancellation_rate=clean(fleet_row['cancellation_rate']),
+        # Share of outlets that are slower than this one
+        faster_than_pct=None if kpt_percentile is None else 100 - kpt_percentile,
+    )
@@ -0,0 +1,151 @@
+import io
+import os
+import base64
+import hashlib
+import shutil
+import threading
+
+import pdfkit
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; the logo is then embedded as-is
+    Image = None
+
+# The logo prints at most 250x80 CSS px (.hero-logo); keep 2x that for sharp print output
+LOGO_MAX_SIZE = (500, 160)
+
+WKHTMLTOPDF_PATHS = [
+    r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe',
+    r'C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe',
+    r'/usr/bin/wkhtmltopdf',
+    r'/usr/local/bin/wkhtmltopdf'
+]
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def encode_logo(data, max_size=LOGO_MAX_SIZE):
+    """
+    Base64 of the logo image bytes, downscaled to max_size when Pillow is available.
+    """
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.width > max_size[0] or image.height > max_size[1]:
+                image.thumbnail(max_size)
+                out = io.BytesIO()
+                if image.mode in ("RGBA", "LA", "P"):
+                    image.save(out, format="PNG", optimize=True)
+                else:
+                    image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+                data = out.getvalue()
+        except Exception:
+            pass
+    return base64.b64encode(data).decode()
+
+def find_wkhtmltopdf():
+    """
+    Path to the wkhtmltopdf executable, or None if it cannot be found.
+    """
+    system_path = shutil.which("wkhtmltopdf")
+    if system_path:
+        return system_path
+    # Fallback to common hardcoded paths
+    for path in WKHTMLTOPDF_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+class RenderContext:
+    """
+    Everything report rendering needs that does not change between reports, built once
+    per process: a Jinja Environment with a bytecode cache, the encoded logo and the
+    wkhtmltopdf configuration. The template and logo are reloaded when their files change.
+    """
+
+    def __init__(self, template_path="template.html", logo_path="logo.jpg", cache_dir=None):
+        self.template_path = template_path
+        self.logo_path = logo_path
+        cache_dir = cache_dir or os.getenv('TEMPLATE_CACHE_DIR', os.path.join('.cache', 'jinja'))
+        os.makedirs(cache_dir, exist_ok=True)
+        self.env = Environment(
+            loader=FileSystemLoader(os.path.dirname(os.path.abspath(template_path))),
+            bytecode_cache=FileSystemBytecodeCache(cache_dir),
+            auto_reload=True,
+        )
+        self._logos = {}  # path -> (mtime, b64)
+        self._template_hash = None  # (mtime, sha256)
+        self._pdfkit_config = None
+        self._config_resolved = False
+        self._lock = threading.Lock()
+
+    def template(self, name=None):
+        """
+        The compiled report template; recompiled only when the file changes.
+        """
+        return self.env.get_template(name or os.path.basename(self.template_path))
+
+    def template_hash(self):
+        """
+        sha256 of the report template file, recomputed only when the file changes.
+        """
+        mtime = _mtime(self.template_path)
+        with self._lock:
+            if self._template_hash and self._template_hash[0] == mtime:
+                return self._template_hash[1]
+        with open(self.template_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._template_hash = (mtime, digest)
+        return digest
+
+    def logo_b64(self, path=None):
+        """
+        The base64 logo for embedding, or None if it is missing or unreadable.
+        """
+        path = path or self.logo_path
+        mtime = _mtime(path)
+        if mtime is None:
+            return None
+        with self._lock:
+            cached = self._logos.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "rb") as f:
+                encoded = encode_logo(f.read())
+        except Exception:
+            return None
+        with self._lock:
+            self._logos[path] = (mtime, encoded)
+        return encoded
+
+    def pdfkit_config(self):
+        """
+        pdfkit configuration for the wkhtmltopdf found on this machine, resolved once.
+        None lets pdfkit report the missing executable.
+        """
+        with self._lock:
+            if not self._config_resolved:
+                path = find_wkhtmltopdf()
+                self._pdfkit_config = pdfkit.configuration(wkhtmltopdf=path) if path else None
+                self._config_resolved = True
+            return self._pdfkit_config
+
+_context = None
+_context_lock = threading.Lock()
+
+def get_render_context():
+    """
+    The process-wide RenderContext (each PDF worker process builds its own).
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = RenderContext()
+        return _context
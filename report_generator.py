@@ -0,0 +1,282 @@
+"""
+Headless entry point for scheduled and scripted runs:
+
+    python -m report_generator run --sheet <url> [--sheet <url> ...] --email --summary run.json
+    python -m report_generator run --file export.csv --brand "Burger King" --output-dir reports/
+    python -m report_generator run --snapshot latest --output-dir reports/
+
+Sheets need service account credentials: --credentials <file>, or the JSON in GCP_JSON.
+Sheets and files are loaded like in the app: unchanged sheets come from the latest snapshot
+and new data is written as a snapshot. --snapshot runs offline from a stored snapshot.
+Prints (or writes with --summary) a JSON run summary and exits with status 1 when any outlet failed.
+Each run is journaled (JOURNAL_DB); `--resume <run id>` or `--resume latest` finishes an interrupted one
+without mailing anyone twice.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import pandas as pd
+
+from archive import safe_filename
+from journal import get_journal, source_fingerprint
+from main import email_reports, generate_consolidated_reports, generate_reports_parallel, prepare_data, record_metrics
+from schema import describe_mapping
+from sheets import parse_credentials, sheet_cache
+from snapshots import snapshot_store
+from uploads import upload_cache
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def load_credentials(path=None):
+    """
+    Service account credentials from a JSON file, or from the GCP_JSON environment variable.
+    """
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return parse_credentials(f.read())
+    raw = os.getenv('GCP_JSON')
+    if not raw:
+        raise ValueError("No credentials: pass --credentials or set GCP_JSON")
+    return parse_credentials(raw)
+
+def snapshot_path(name):
+    """
+    Resolves --snapshot: 'latest', a snapshot file, or a path relative to SNAPSHOT_DIR.
+    """
+    if name == "latest":
+        path = snapshot_store.latest()
+        if path is None:
+            raise ValueError(f"No snapshots in {snapshot_store.root}")
+        return path
+    for path in (name, os.path.join(snapshot_store.root, name)):
+        if os.path.isfile(path):
+            return path
+    raise ValueError(f"Snapshot not found: {name}")
+
+def load_data(sheets=None, files=None, credentials=None, sheet_workers=8, snapshot=None):
+    """
+    Loads and combines every sheet (URL or name) and file (CSV/Excel) through the shared
+    sheet and upload caches, so unchanged sheets are read from the latest snapshot and new
+    data is stored as one. With snapshot ('latest' or a path) only that snapshot is read,
+    without network access. Returns (df, problems).
+    """
+    if snapshot:
+        path = snapshot_path(snapshot)
+        _log(f"Reading snapshot {path}")
+        return snapshot_store.read(path), []
+
+    frames, problems = [], []
+    if sheets:
+        combined, results = sheet_cache.load(sheets, load_credentials(credentials), max_workers=sheet_workers)
+        for result in results:
+            if result.error:
+                problems.append(f"{result.url}: {result.error}")
+            elif result.df is None:
+                problems.append(f"{result.url}: no data")
+        if combined is not None:
+            frames.append(combined)
+    for path in files or []:
+        try:
+            with open(path, "rb") as f:
+                frames.append(upload_cache.load(f.read(), os.path.basename(path)))
+        except Exception as e:
+            problems.append(f"{path}: {e}")
+    if not frames:
+        return None, problems
+    return pd.concat(frames, ignore_index=True), problems
+
+def select_pairs(prepared, brands=None, locations=None):
+    """
+    Outlets in the data, limited to the given brands and locations (case-insensitive) if any.
+    """
+    brands = {b.strip().lower() for b in brands or []}
+    locations = {l.strip().lower() for l in locations or []}
+    return [
+        (b, l) for b, l in prepared.outlet_pairs()
+        if (not brands or b.strip().lower() in brands) and (not locations or l.strip().lower() in locations)
+    ]
+
+def run(args):
+    """
+    Executes the `run` command and returns the summary dict.
+    """
+    started = time.time()
+    summary = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "sources": {"sheets": args.sheet or [], "files": args.file or [], "snapshot": args.snapshot},
+        "problems": [],
+        "outlets": [],
+    }
+    sheets = args.sheet or []
+    if not sheets and not args.file and not args.snapshot:
+        # Same fallback as generate_report: the spreadsheet named in the credentials, or Kitchen_Data
+        sheets = [load_credentials(args.credentials).get('spreadsheet', "Kitchen_Data")]
+
+    df, problems = load_data(sheets, args.file, credentials=args.credentials, sheet_workers=args.sheet_workers, snapshot=args.snapshot)
+    summary["problems"].extend(problems)
+    if df is None:
+        raise ValueError("No data loaded: " + "; ".join(problems))
+
+    prepared = prepare_data(df)
+    for note in describe_mapping(prepared.mapping):
+        _log(f"columns: {note}")
+    # Every run is journaled; --resume picks up the unfinished outlets of an earlier one,
+    # started on the same sources (outlets are matched by name)
+    journal = get_journal()
+    kind = 'email' if args.email else 'render'
+    uploads = []
+    for path in args.file or []:
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                uploads.append(f.read())
+    source = source_fingerprint(sheets=sheets, uploads=uploads, snapshot=snapshot_path(args.snapshot) if args.snapshot else None)
+    if args.resume:
+        previous = journal.latest_unfinished(kind, source=source) if args.resume == "latest" else journal.run(args.resume)
+        if previous is None:
+            raise ValueError(f"No run to resume: {args.resume}")
+        if previous["kind"] != kind:
+            raise ValueError(f"Run {previous['run_id']} was a {previous['kind']} run; pass the same --email/--output-dir options")
+        journal.check_source(previous["run_id"], source)
+        run_id = previous["run_id"]
+        pairs = journal.pending(run_id)
+        _log(f"Resuming run {run_id}: {len(pairs)} unfinished outlets")
+    else:
+        pairs = select_pairs(prepared, args.brand, args.location)
+        run_id = journal.start_run(kind, pairs, params={**{k: v for k, v in vars(args).items() if k != "command"}, "source": source})
+        _log(f"Run {run_id}: {len(pairs)} outlets selected from {len(df)} rows")
+    summary["run_id"] = run_id
+
+    history = None
+    if args.trends:
+        from history import MetricsHistory
+        history = MetricsHistory()
+        # Fresh ingests store this week's metrics; a stored snapshot only reads them
+        if not args.snapshot:
+            record_metrics(prepared, history)
+
+    outlets = {pair: {"brand": pair[0], "location": pair[1]} for pair in pairs}
+    progress = lambda done, total: _log(f"  {done}/{total}")
+
+    # 1. PDFs to disk
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        if args.consolidate:
+            _log(f"Rendering consolidated PDFs ({args.consolidate}) to {args.output_dir}")
+            for bundle in generate_consolidated_reports(
+                prepared, pairs, mode=args.consolidate, workers=args.render_workers,
+                include_ai=args.include_ai, history=history, on_progress=progress
+            ):
+                path = None
+                if bundle.pdf:
+                    path = os.path.join(args.output_dir, safe_filename(f"{bundle.name}_report.pdf"))
+                    with open(path, "wb") as f:
+                        f.write(bundle.pdf)
+                for b, l in bundle.outlets:
+                    outlets[(b, l)].update(file=path, render="rendered" if path else "failed", error=bundle.error)
+                    journal.mark(run_id, b, l, 'rendered' if path else 'failed', detail=bundle.error)
+                for b, l, error in bundle.failed:
+                    outlets[(b, l)].update(render="failed", error=error)
+                    journal.mark(run_id, b, l, 'failed', detail=error)
+        else:
+            _log(f"Rendering PDFs to {args.output_dir}")
+            for result in generate_reports_parallel(
+                prepared, pairs, workers=args.render_workers, include_ai=args.include_ai,
+                history=history, on_progress=progress, use_cache=not args.no_cache
+            ):
+                entry = outlets[(result.brand, result.location)]
+                if result.error:
+                    entry.update(render="failed", error=result.error)
+                    journal.mark(run_id, result.brand, result.location, 'failed', detail=result.error)
+                    continue
+                path = os.path.join(args.output_dir, safe_filename(f"{result.brand}_{result.location}_report.pdf"))
+                with open(path, "wb") as f:
+                    f.write(result.pdf)
+                entry.update(file=path, render="reused" if result.cached else "rendered")
+                journal.mark(run_id, result.brand, result.location, 'rendered', recipient=result.manager_email)
+
+    # 2. Email
+    if args.email:
+        _log("Emailing reports")
+        for outcome in email_reports(
+            prepared, pairs, render_workers=args.render_workers, send_workers=args.send_workers,
+            include_ai=args.include_ai, history=history, group_by_recipient=args.group_emails,
+            on_progress=progress, use_cache=not args.no_cache, journal=journal, run_id=run_id
+        ):
+            outlets[(outcome.brand, outcome.location)].update(
+                recipient=outcome.recipient, email=outcome.status, email_detail=outcome.detail
+            )
+
+    summary["outlets"] = list(outlets.values())
+    statuses = [o.get("render") for o in summary["outlets"]]
+    emails = [o.get("email") for o in summary["outlets"]]
+    summary["totals"] = {
+        "outlets": len(pairs),
+        "rendered": statuses.count("rendered"),
+        "reused": statuses.count("reused"),
+        "render_failed": statuses.count("failed"),
+        "sent": emails.count("sent"),
+        "skipped": emails.count("skipped"),
+        "email_failed": emails.count("failed"),
+        "unconfirmed": emails.count("unconfirmed"),
+    }
+    summary["run_status"] = journal.finish_run(run_id)
+    summary["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    summary["duration_seconds"] = round(time.time() - started, 2)
+    return summary
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="report_generator", description="Kytchens report generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_cmd = commands.add_parser("run", help="Generate (and optionally email) reports for many outlets")
+    run_cmd.add_argument("--sheet", action="append", help="Google Sheet URL or name (repeatable)")
+    run_cmd.add_argument("--file", action="append", help="CSV or Excel export (repeatable)")
+    run_cmd.add_argument("--snapshot", nargs="?", const="latest", metavar="PATH",
+                         help="Run offline from a stored snapshot instead ('latest' if no path is given)")
+    run_cmd.add_argument("--credentials", help="Service account JSON file (default: GCP_JSON env var)")
+    run_cmd.add_argument("--brand", action="append", help="Only these brands (repeatable)")
+    run_cmd.add_argument("--location", action="append", help="Only these locations (repeatable)")
+    run_cmd.add_argument("--output-dir", help="Write PDFs to this directory")
+    run_cmd.add_argument("--consolidate", choices=["brand", "fleet"], help="Write one PDF per brand or one for the fleet")
+    run_cmd.add_argument("--email", action=argparse.BooleanOptionalAction, default=False, help="Email each report to its manager")
+    run_cmd.add_argument("--group-emails", action="store_true", help="One email per manager with all their outlets")
+    run_cmd.add_argument("--render-workers", type=int, default=None, help="PDF worker processes (default: CPU count)")
+    run_cmd.add_argument("--send-workers", type=int, default=2, help="Parallel SMTP senders")
+    run_cmd.add_argument("--sheet-workers", type=int, default=8, help="Sheets fetched in parallel")
+    run_cmd.add_argument("--include-ai", action="store_true", help="Add Gemini recommendations")
+    run_cmd.add_argument("--trends", action="store_true", help="Record this week's metrics and add week-over-week trends")
+    run_cmd.add_argument("--no-cache", action="store_true", help="Render every PDF even if a cached copy matches")
+    run_cmd.add_argument("--summary", help="Write the JSON run summary here instead of stdout")
+    run_cmd.add_argument("--resume", metavar="RUN_ID", help="Continue an interrupted run ('latest' for the most recent unfinished one); pass the same sources")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.output_dir and not args.email:
+        build_parser().error("nothing to do: pass --output-dir and/or --email")
+    if args.snapshot and (args.sheet or args.file):
+        build_parser().error("--snapshot cannot be combined with --sheet or --file")
+    try:
+        summary = run(args)
+    except Exception as e:
+        _log(f"Run failed: {e}")
+        return 2
+
+    output = json.dumps(summary, indent=2, default=str)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(output)
+        _log(f"Summary written to {args.summary}")
+    else:
+        print(output)
+
+    totals = summary["totals"]
+    _log(f"Done: {totals}")
+    return 1 if totals["render_failed"] or totals["email_failed"] or totals["unconfirmed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
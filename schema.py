@@ -0,0 +1,135 @@
+import os
+import json
+import threading
+from collections import namedtuple
+
+# Fields stored as text; every other field is a numeric metric.
+# source_url is the Source_URL column added when sheets are combined, not a configured field.
+TEXT_FIELDS = ['brand', 'location', 'manager_email', 'source_url']
+REQUIRED_FIELDS = ['brand', 'location']
+
+# Column used for each field when the header has none (lookups then fall back to defaults)
+DEFAULT_COLUMNS = {
+    'orders': 'Orders',
+    'kitchen_errors': 'Kitchen Errors',
+    'kpt': 'KPT',
+    'manager_email': 'Manager_Email',
+    'mfr_cancellations': 'MFR Cancellations',
+    'mfr_errors': 'MFR Errors',
+    'source_url': 'Source_URL',
+}
+
+# Result of resolving a header. header is the stripped header.
+# columns: {field: header label} for every field found, in header order.
+# missing: configured fields with no matching column.
+# ambiguous: {field: [candidates]} when several columns matched equally well; the first is used.
+ColumnMapping = namedtuple("ColumnMapping", ["header", "columns", "missing", "ambiguous"])
+
+_synonyms = {}
+_mappings = {}
+_lock = threading.Lock()
+
+def synonyms_path():
+    return os.getenv('COLUMN_SYNONYMS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'column_synonyms.json'))
+
+def _version(path):
+    return path, os.path.getmtime(path)
+
+def load_synonyms(path=None):
+    """
+    Header synonyms for each field, in priority order, from the config file
+    (COLUMN_SYNONYMS_FILE, default column_synonyms.json). Re-read only when the file changes.
+    """
+    version = _version(path or synonyms_path())
+    with _lock:
+        if version not in _synonyms:
+            with open(version[0], encoding="utf-8") as f:
+                _synonyms.clear()
+                _synonyms[version] = json.load(f)
+        return _synonyms[version]
+
+def find_col(columns, possible_names):
+    """
+    Returns the first column matching one of possible_names, exact (case-insensitive) first, then partial.
+    """
+    lowered = [p.lower() for p in possible_names]
+    # Case 1: Exact Match (stripped)
+    for col in columns:
+        if col.lower() in lowered:
+            return col
+    # Case 2: Partial Match
+    for col in columns:
+        for p in lowered:
+            if p in col.lower(): return col
+    return None
+
+def resolve_columns(header, path=None):
+    """
+    Resolves a header (any iterable of labels) to a ColumnMapping. Results are memoized
+    by the stripped header and the synonyms file version, so repeat calls cost a dict lookup.
+    """
+    signature = tuple(str(c).strip() for c in header)
+    version = _version(path or synonyms_path())
+    key = (signature, version)
+    with _lock:
+        mapping = _mappings.get(key)
+    if mapping is not None:
+        return mapping
+
+    synonyms = load_synonyms(version[0])
+    lowered = [c.lower() for c in signature]
+    exact = {
+        field: [c for c, low in zip(signature, lowered) if low in {n.lower() for n in names}]
+        for field, names in synonyms.items()
+    }
+    claimed = {c for cols in exact.values() for c in cols}
+
+    found, missing, ambiguous = {}, [], {}
+    for field, names in synonyms.items():
+        col = find_col(signature, names)
+        if col is None:
+            missing.append(field)
+            continue
+        found[field] = col
+        # Ties at the stage that won; a partial match ignores columns another field names exactly
+        candidates = exact[field] or [
+            c for c, low in zip(signature, lowered)
+            if c not in claimed and any(n.lower() in low for n in names)
+        ]
+        if len(candidates) > 1:
+            ambiguous[field] = candidates
+    if 'Source_URL' in signature:
+        found['source_url'] = 'Source_URL'
+
+    order = {c: i for i, c in enumerate(signature)}
+    columns = dict(sorted(found.items(), key=lambda item: order[item[1]]))
+    mapping = ColumnMapping(signature, columns, missing, ambiguous)
+    with _lock:
+        if len(_mappings) > 256:
+            _mappings.clear()
+        _mappings[key] = mapping
+    return mapping
+
+def require_columns(mapping):
+    """
+    Raises ValueError when a mapping lacks the Brand or Location column.
+    """
+    if any(f in mapping.missing for f in REQUIRED_FIELDS):
+        raise ValueError(f"Could not find Brand or Location columns. Found: {list(mapping.header)}")
+
+def column_for(mapping, field):
+    """
+    The column for field, or its default name when the header has none.
+    """
+    return mapping.columns.get(field) or DEFAULT_COLUMNS.get(field)
+
+def describe_mapping(mapping):
+    """
+    Human-readable notes on missing and ambiguous fields, for the UI and logs.
+    """
+    notes = []
+    if mapping.missing:
+        notes.append("Missing columns: " + ", ".join(mapping.missing))
+    for field, candidates in mapping.ambiguous.items():
+        notes.append(f"{field}: using '{mapping.columns[field]}' (also matched {', '.join(repr(c) for c in candidates if c != mapping.columns[field])})")
+    return notes
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import threading
+import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from snapshots import snapshot_store
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# One sheet's fetch result. df is None when the sheet was empty or failed; error holds the reason.
+SheetResult = namedtuple("SheetResult", ["url", "df", "error"])
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def parse_credentials(creds_dict):
+    """
+    Normalizes service account credentials from secrets: accepts a JSON string or a mapping
+    and heals escaped newlines in the private key.
+    """
+    # Cloud Resiliency: Handle potential string-pasting issues
+    if isinstance(creds_dict, str):
+        try:
+            clean_json = creds_dict.replace('\\\\', '\\')
+            creds_dict = json.loads(clean_json)
+        except Exception as e:
+            raise ValueError(f"Failed to parse Credentials JSON. Error: {e}")
+    creds_dict = dict(creds_dict)
+    if "private_key" in creds_dict:
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
+    return creds_dict
+
+def get_sheets_client(creds_dict):
+    """
+    Returns an authorized gspread client for these credentials, reusing the cached one
+    until its access token expires.
+    """
+    creds_dict = parse_credentials(creds_dict)
+    key = (creds_dict.get("client_email"), creds_dict.get("private_key_id"))
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached:
+            creds, client = cached
+            if not creds.access_token_expired:
+                return client
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+        client = gspread.authorize(creds)
+        _clients[key] = (creds, client)
+        return client
+
+def open_spreadsheet(client, sheet_identifier):
+    """
+    Opens a spreadsheet given by URL or by name.
+    """
+    if "docs.google.com/spreadsheets" in str(sheet_identifier):
+        return client.open_by_url(sheet_identifier)
+    return client.open(sheet_identifier)
+
+def open_worksheet(client, sheet_identifier):
+    """
+    Opens the first worksheet of a spreadsheet given by URL or by name.
+    """
+    return open_spreadsheet(client, sheet_identifier).get_worksheet(0)
+
+def spreadsheet_version(spreadsheet):
+    """
+    Cheap freshness signal: the spreadsheet's last-modified time from Drive, or None if unavailable.
+    """
+    try:
+        getter = getattr(spreadsheet, "get_lastUpdateTime", None)
+        return getter() if getter else spreadsheet.lastUpdateTime
+    except Exception:
+        return None
+
+def _records_to_result(url, data):
+    if not data:
+        return SheetResult(url, None, None)
+    sheet_df = pd.DataFrame(data)
+    sheet_df['Source_URL'] = url
+    return SheetResult(url, sheet_df, None)
+
+def fetch_sheet(client, url):
+    """
+    Downloads one sheet as a DataFrame tagged with Source_URL. Returns a SheetResult.
+    """
+    try:
+        data = open_worksheet(client, url).get_all_records()
+    except Exception as e:
+        return SheetResult(url, None, str(e))
+    return _records_to_result(url, data)
+
+def fetch_sheets(urls, creds_dict=None, client=None, max_workers=8):
+    """
+    Fetches many sheets concurrently with at most max_workers requests in flight.
+    Returns one SheetResult per URL, in order; a failing sheet does not stop the others.
+    Pass client to use an existing (or stubbed) gspread client instead of creds_dict.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    if client is None:
+        client = get_sheets_client(creds_dict)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as pool:
+        return list(pool.map(lambda url: fetch_sheet(client, url), urls))
+
+def combine_sheets(results):
+    """
+    Concatenates the non-empty frames of fetch_sheets results, or returns None if there are none.
+    """
+    frames = [r.df for r in results if r.df is not None]
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+class SheetCache:
+    """
+    Keeps downloaded sheets between Streamlit reruns and sessions. A sheet is downloaded
+    again only when its last-modified time changes; that check itself runs at most once
+    per check_interval seconds (SHEET_CHECK_INTERVAL, default 60).
+    With a SnapshotStore, unchanged sheets are read from the latest snapshot after a restart
+    and every load that downloaded something is written as a new snapshot.
+    """
+
+    def __init__(self, check_interval=None, store=None):
+        if check_interval is None:
+            check_interval = float(os.getenv('SHEET_CHECK_INTERVAL', 60))
+        self.check_interval = check_interval
+        self.store = store
+        self._entries = {}  # url -> {"version", "result", "fetched_at", "checked_at"}
+        self._combined = {}
+        self._lock = threading.Lock()
+
+    def _load_one(self, client, url, force):
+        """
+        Returns (SheetResult, downloaded).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry and not force and now - entry["checked_at"] < self.check_interval:
+            return entry["result"], False
+
+        downloaded = False
+        try:
+            spreadsheet = open_spreadsheet(client, url)
+            version = spreadsheet_version(spreadsheet)
+            if entry and not force and version is not None and version == entry["version"]:
+                with self._lock:
+                    entry["checked_at"] = now
+                return entry["result"], False
+
+            rows = None if (force or self.store is None) else self.store.cached_source(url, version)
+            if rows is not None:
+                result = SheetResult(url, rows if len(rows) else None, None)
+            else:
+                result = _records_to_result(url, spreadsheet.get_worksheet(0).get_all_records())
+                downloaded = True
+        except Exception as e:
+            return SheetResult(url, None, str(e)), False
+
+        with self._lock:
+            self._entries[url] = {"version": version, "result": result, "fetched_at": now, "checked_at": now}
+        return result, downloaded
+
+    def load(self, urls, creds_dict=None, client=None, max_workers=8, force=False):
+        """
+        Like fetch_sheets, but serves unchanged sheets from the cache.
+        Returns (combined_df or None, results).
+        """
+        urls = list(urls)
+        if not urls:
+            return None, []
+        if client is None:
+            client = get_sheets_client(creds_dict)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as pool:
+            loaded = list(pool.map(lambda url: self._load_one(client, url, force), urls))
+        results = [result for result, _ in loaded]
+        downloaded = any(d for _, d in loaded)
+
+        # Reuse the combined frame while every sheet is the same object as last time
+        key = tuple(urls)
+        with self._lock:
+            cached = self._combined.get(key)
+            if cached and len(cached[0]) == len(results) and all(a is b for a, b in zip(cached[0], results)):
+                return cached[1], results
+        combined = combine_sheets(results)
+        with self._lock:
+            self._combined = {key: (results, combined)}
+            versions = {u: self._entries[u]["version"] for u in urls if u in self._entries}
+
+        if downloaded and combined is not None and self.store is not None:
+            try:
+                self.store.write(combined, sources=versions)
+            except Exception:
+                # History is best effort; never fail a load because the snapshot could not be written
+                pass
+        return combined, results
+
+    def age(self, urls):
+        """
+        Seconds since the oldest of these sheets was downloaded, or None if none are cached.
+        """
+        with self._lock:
+            times = [self._entries[u]["fetched_at"] for u in urls if u in self._entries]
+        return time.time() - min(times) if times else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._combined.clear()
+
+# Shared by every Streamlit session in this process
+sheet_cache = SheetCache(store=snapshot_store)
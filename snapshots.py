@@ -0,0 +1,118 @@
+import os
+import json
+import datetime
+import threading
+import pandas as pd
+
+class SnapshotStore:
+    """
+    Local history of ingested frames as Parquet files partitioned by ingest date:
+    <root>/ingest_date=YYYY-MM-DD/snapshot-HHMMSS-ffffff.parquet, each with a JSON manifest
+    recording the version of every source (sheet URL or upload hash) it was built from.
+    Reads are memory-mapped and can be limited to columns or a single source.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv('SNAPSHOT_DIR', os.path.join('data', 'snapshots'))
+        self._lock = threading.Lock()
+
+    # Writing
+
+    @staticmethod
+    def _to_storable(df):
+        """
+        Parquet needs one type per column: object columns that hold only numbers and blanks
+        become numeric, everything else becomes text.
+        """
+        out = df.copy()
+        out.columns = [str(c) for c in out.columns]
+        for col in out.columns:
+            if out[col].dtype != object and not pd.api.types.is_string_dtype(out[col]):
+                continue
+            blank = out[col].isna() | (out[col].astype(str).str.strip() == '')
+            numeric = pd.to_numeric(out[col].where(~blank), errors='coerce')
+            if numeric[~blank].notna().all():
+                out[col] = numeric
+            else:
+                out[col] = out[col].where(~out[col].isna(), '').astype(str)
+        return out
+
+    def write(self, df, sources=None):
+        """
+        Stores df as a new snapshot. sources maps each source key to its version.
+        Returns the snapshot path.
+        """
+        now = datetime.datetime.now()
+        folder = os.path.join(self.root, f"ingest_date={now:%Y-%m-%d}")
+        path = os.path.join(folder, f"snapshot-{now:%H%M%S-%f}.parquet")
+        with self._lock:
+            os.makedirs(folder, exist_ok=True)
+            tmp = path + ".tmp"
+            self._to_storable(df).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            with open(path[:-len(".parquet")] + ".json", "w", encoding="utf-8") as f:
+                json.dump({"created_at": now.isoformat(), "rows": len(df), "sources": sources or {}}, f)
+        return path
+
+    # Reading
+
+    def list_snapshots(self):
+        """
+        Returns every snapshot path, oldest first.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        paths = []
+        for partition in sorted(os.listdir(self.root)):
+            folder = os.path.join(self.root, partition)
+            if partition.startswith("ingest_date=") and os.path.isdir(folder):
+                paths.extend(os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".parquet"))
+        return paths
+
+    def latest(self):
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def manifest(self, path):
+        try:
+            with open(path[:-len(".parquet")] + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"sources": {}}
+
+    @staticmethod
+    def _from_storable(df):
+        # Whole-number columns come back as ints with '' for blanks, as get_all_records returns them
+        for col in df.columns:
+            s = df[col]
+            if s.dtype.kind == 'f':
+                valid = s.dropna()
+                if (valid == valid.round()).all():
+                    df[col] = s.astype('Int64').astype(object).where(s.notna(), '')
+        return df
+
+    def read(self, path=None, columns=None, source=None):
+        """
+        Reads a snapshot (the latest by default), memory-mapped. columns limits the columns
+        read; source keeps only the rows whose Source_URL equals it. Returns None if there is none.
+        """
+        path = path or self.latest()
+        if not path:
+            return None
+        filters = [('Source_URL', '==', source)] if source is not None else None
+        df = pd.read_parquet(path, columns=columns, filters=filters, memory_map=True)
+        return self._from_storable(df)
+
+    def cached_source(self, source, version):
+        """
+        Delta support: returns the latest snapshot's rows for source when that snapshot was
+        built from the same version, an empty frame if the source had no rows, else None.
+        """
+        path = self.latest()
+        if not path or version is None:
+            return None
+        if self.manifest(path).get("sources", {}).get(source) != version:
+            return None
+        return self.read(path, source=source)
+
+snapshot_store = SnapshotStore()
@@ -2,9 +2,67 @@ import streamlit as st
 import json
 import pandas as pd
 import os
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from main import generate_report_from_df, send_email
+import uuid
+from cache import get_ai_cache
+from artifacts import get_artifact_cache
+from sheets import sheet_cache
+from snapshots import snapshot_store
+from history import MetricsHistory
+from uploads import upload_cache
+from schema import describe_mapping, resolve_columns
+from journal import DONE_STATES, get_journal, source_fingerprint
+from jobs import email_job, generate_job, get_job_queue
+from main import generate_report_from_df, prepare_data, record_metrics, send_email
+
+@st.cache_resource
+def metrics_history():
+    return MetricsHistory()
+
+@st.cache_resource(max_entries=2)
+def read_snapshot(path, mtime):
+    # Keyed by path and mtime so reruns get the same frame object (and the same prepared_data entry)
+    return snapshot_store.read(path)
+
+@st.cache_resource(max_entries=4, hash_funcs={pd.DataFrame: id})
+def prepared_data(df):
+    # Cached loads return the same frame object across reruns, so it is keyed by identity.
+    # The frame is kept with the result so its id cannot be reused while cached.
+    return df, prepare_data(df)
+
+# Fragments arrived as experimental_fragment; both re-run on their own with run_every
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+def show_outlets(job):
+    if job.run_id:
+        outlets = get_journal().outlets(job.run_id)
+        if outlets:
+            st.dataframe(pd.DataFrame(outlets), use_container_width=True, hide_index=True)
+
+@_fragment(run_every=2)
+def active_jobs(owner):
+    """
+    Live progress of this session's queued and running bulk jobs, polled every 2 seconds.
+    """
+    queue = get_job_queue()
+    mine = [job for job in queue.jobs(owner=owner) if not job.finished]
+    watching = st.session_state.setdefault("watching_jobs", set())
+    if watching - {job.job_id for job in mine}:
+        # A job finished: rerun the page so its results and download appear below
+        st.session_state["watching_jobs"] = {job.job_id for job in mine}
+        st.rerun()
+    watching.update(job.job_id for job in mine)
+    others = len(queue.active()) - len(mine)
+    if others:
+        st.caption(f"🧵 {others} other job(s) running or queued on this server")
+    for job in mine:
+        with st.container(border=True):
+            title, action = st.columns([4, 1])
+            title.markdown(f"**{job.label}** — {job.status}{' (cancelling…)' if job.cancelled else ''}")
+            if action.button("⛔ Cancel", key=f"cancel_{job.job_id}", disabled=job.cancelled):
+                job.cancel()
+            st.progress(job.done / job.total if job.total else 0.0, text=f"{job.done} / {job.total or '?'}")
+            with st.expander("📋 Per-outlet results"):
+                show_outlets(job)
 
 # Page Config
 st.set_page_config(page_title="Kytchens Report Generator", page_icon="page_icon.png", layout="wide")
@@ -47,20 +105,70 @@ st.subheader("Professional AI-Powered Report Portal")
 
 # Sidebar for Settings
 st.sidebar.title("Settings")
-mode = st.sidebar.radio("Data Source", ["📁 Upload Excel/CSV", "🌐 Google Sheets"])
+mode = st.sidebar.radio("Data Source", ["📁 Upload Excel/CSV", "🌐 Google Sheets", "🗄️ Local Snapshot"])
+pdf_workers = st.sidebar.number_input("PDF workers (bulk)", min_value=1, max_value=32, value=os.cpu_count() or 1)
+sheet_workers = st.sidebar.number_input("Sheet downloads in parallel", min_value=1, max_value=32, value=8)
+email_workers = st.sidebar.number_input("Email workers (bulk)", min_value=1, max_value=8, value=2)
+include_ai = st.sidebar.checkbox("Include AI recommendations", value=False)
+include_trends = st.sidebar.checkbox("Week-over-week trends", value=True)
+history = metrics_history() if include_trends else None
+
+with st.sidebar.expander("🧠 AI Cache"):
+    ai_cache = get_ai_cache()
+    cache_stats = ai_cache.stats()
+    st.caption(f"{cache_stats['entries']} entries • {cache_stats['hits']} hits • {cache_stats['misses']} misses")
+    if st.button("Clear AI cache"):
+        ai_cache.clear()
+        st.success("AI cache cleared.")
+
+with st.sidebar.expander("🗃️ PDF Cache"):
+    pdf_cache = get_artifact_cache()
+    pdf_stats = pdf_cache.stats()
+    st.caption(f"{pdf_stats['entries']} PDFs • {pdf_stats['bytes'] / 1024 / 1024:.1f} MB • {pdf_stats['hits']} reused")
+    if st.button("Clear PDF cache"):
+        pdf_cache.clear()
+        st.success("PDF cache cleared.")
+
+# Re-fetches this session's sources only; other sessions keep their cached data
+refresh_data = st.sidebar.button("🔄 Refresh data")
+
+def format_age(seconds):
+    if seconds is None:
+        return "not cached"
+    if seconds < 60:
+        return "just now"
+    return f"{int(seconds // 60)} min ago"
 
 df = None
 sheet_urls = []
+source = None  # source_fingerprint of the loaded data, recorded with email runs
 
 if mode == "📁 Upload Excel/CSV":
     uploaded_file = st.file_uploader("Choose a file", type=["xlsx", "csv"])
     if uploaded_file:
         try:
-            df = pd.read_csv(uploaded_file) if uploaded_file.name.endswith('.csv') else pd.read_excel(uploaded_file)
+            file_bytes = uploaded_file.getvalue()
+            df = upload_cache.load(file_bytes, uploaded_file.name, force=refresh_data)
+            source = source_fingerprint(uploads=[file_bytes])
             st.success("File uploaded!")
+            st.sidebar.caption(f"📦 File parsed {format_age(upload_cache.age(file_bytes))}")
         except Exception as e:
             st.error(f"Error: {e}")
 
+elif mode == "🗄️ Local Snapshot":
+    snapshots = snapshot_store.list_snapshots()
+    if snapshots:
+        labels = {os.path.relpath(p, snapshot_store.root): p for p in reversed(snapshots)}
+        chosen = st.selectbox("Snapshot (offline / backfill)", options=list(labels))
+        try:
+            df = read_snapshot(labels[chosen], os.path.getmtime(labels[chosen]))
+            source = source_fingerprint(snapshot=labels[chosen])
+            st.success(f"Loaded snapshot with {len(df)} records.")
+        except Exception as e:
+            st.error(f"Error reading snapshot: {e}")
+    else:
+        st.warning("No local snapshots yet. Load data from Google Sheets or a file first.")
+
 else:  # Google Sheets Mode
     st.info("💡 You can enter multiple Google Sheet URLs (one per line) to combine data from all of them.")
     sheet_urls_raw = st.text_area("Google Sheet URL(s)", height=100, placeholder="https://docs.google.com/spreadsheets/d/...\nhttps://docs.google.com/spreadsheets/d/...")
@@ -77,33 +185,23 @@ else:  # Google Sheets Mode
                 st.error("GCP credentials not found in secrets.")
                 st.stop()
             
-            if "private_key" in creds_dict:
-                creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
-            
-            scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-            client = gspread.authorize(creds)
-            
-            all_dfs = []
             with st.spinner(f"Connecting to {len(sheet_urls)} sheets..."):
-                for i, url in enumerate(sheet_urls):
-                    try:
-                        sheet = client.open_by_url(url).get_worksheet(0)
-                        data = sheet.get_all_records()
-                        if data:
-                            sheet_df = pd.DataFrame(data)
-                            sheet_df['Source_URL'] = url
-                            all_dfs.append(sheet_df)
-                        else:
-                            st.warning(f"Sheet {i+1} is empty.")
-                    except Exception as sheet_err:
-                        st.error(f"Error loading sheet {i+1}: {sheet_err}")
+                df, results = sheet_cache.load(sheet_urls, creds_dict, max_workers=sheet_workers, force=refresh_data)
+                source = source_fingerprint(sheets=sheet_urls)
+                st.sidebar.caption(f"📦 Sheet data fetched {format_age(sheet_cache.age(sheet_urls))}")
+                for i, result in enumerate(results):
+                    if result.error:
+                        st.error(f"Error loading sheet {i+1}: {result.error}")
+                    elif result.df is None:
+                        st.warning(f"Sheet {i+1} is empty.")
                 
-                if all_dfs:
-                    df = pd.concat(all_dfs, ignore_index=True)
-                    st.success(f"Connected! Combined {len(all_dfs)} sheets with {len(df)} total records.")
+                if df is not None:
+                    loaded = sum(1 for r in results if r.df is not None)
+                    st.success(f"Connected! Combined {loaded} sheets with {len(df)} total records.")
                     with st.expander("📊 Data Preview (Source URLs)"):
-                        st.write(df[['Brand', 'Location', 'Source_URL']].head())
+                        mapping = resolve_columns(df.columns)
+                        preview = [c for c in df.columns if str(c).strip() in (mapping.columns.get('brand'), mapping.columns.get('location'), 'Source_URL')]
+                        st.write(df[preview].head())
                 else:
                     st.error("No data found in any of the provided sheets.")
 
@@ -115,17 +213,20 @@ else:  # Google Sheets Mode
 # Report Generation
 st.divider()
 if df is not None:
-    df.columns = [str(c).strip() for c in df.columns]
-    brand_col = next((c for c in df.columns if c.lower() in ['brand', 'brand name', 'company', 'restaurant']), None)
-    loc_col = next((c for c in df.columns if c.lower() in ['location', 'store', 'outlet', 'city', 'area']), None)
-    
-    if brand_col and loc_col:
-        current_brands = sorted([str(b).strip() for b in df[brand_col].unique() if b])
+    # Columns are resolved once per header by the shared schema; the prepared frame is reused across reruns
+    try:
+        _, prepared = prepared_data(df)
+    except ValueError:
+        prepared = None
+
+    if prepared is not None:
+        for note in describe_mapping(prepared.mapping):
+            st.caption(f"🧭 {note}")
+        current_brands = sorted(set(prepared.all_brands))
         col1, col2 = st.columns(2)
         with col1: brand = st.selectbox("Select Brand", options=current_brands)
         with col2:
-            brand_mask = df[brand_col].astype(str).str.strip() == brand
-            relevant_locs = sorted([str(l).strip() for l in df[brand_mask][loc_col].unique() if l])
+            relevant_locs = sorted({str(l).strip() for l in prepared.brand_locations.get(str(brand).lower(), []) if str(l).strip()})
             location = st.selectbox("Select Location", options=relevant_locs)
                 
         col_dl, col_em = st.columns(2)
@@ -135,7 +236,7 @@ if df is not None:
             if st.button("🚀 Generate & Download Single Report"):
                 try:
                     with st.spinner("Generating..."):
-                        pdf_data, email_addr = generate_report_from_df(df, brand, location, spreadsheet_url=fallback_url)
+                        pdf_data, email_addr = generate_report_from_df(prepared, brand, location, spreadsheet_url=fallback_url, include_ai=include_ai, history=history)
                         st.success(f"Generated!")
                         st.download_button(
                             label="📥 Download PDF",
@@ -150,7 +251,7 @@ if df is not None:
             if st.button("📧 Generate & Send via Email"):
                 try:
                     with st.spinner("Sending email..."):
-                        pdf_data, email_addr = generate_report_from_df(df, brand, location, spreadsheet_url=fallback_url)
+                        pdf_data, email_addr = generate_report_from_df(prepared, brand, location, spreadsheet_url=fallback_url, include_ai=include_ai, history=history)
                         if email_addr and "@" in str(email_addr):
                             success, msg = send_email(pdf_data, email_addr, brand)
                             if success: st.success(msg)
@@ -160,43 +261,69 @@ if df is not None:
                 except Exception as e:
                     st.error(f"Error: {e}")
 
-        # Bulk processing
+        # Bulk processing runs on the shared background job queue, so the page stays usable
         st.divider()
         st.subheader("📦 Bulk Processing")
+        job_queue = get_job_queue()
+        owner = st.session_state.setdefault("job_owner", uuid.uuid4().hex)
+        bundle_mode = st.radio("PDF output", ["One PDF per outlet", "One PDF per brand", "One PDF for the fleet"], horizontal=True)
+        group_emails = st.checkbox("Send one email per manager (all their outlets attached)", value=False)
+        email_options = dict(source=source, render_workers=pdf_workers, send_workers=email_workers, spreadsheet_url=fallback_url,
+                             include_ai=include_ai, history=history, group_by_recipient=group_emails)
         col_b1, col_b2 = st.columns(2)
-        
-        if col_b1.button("🗂️ Bulk Generate All Reports (ZIP)"):
-            import zipfile, io
-            try:
-                combinations = df[[brand_col, loc_col]].drop_duplicates().values.tolist()
-                combinations = [c for c in combinations if str(c[0]).strip() and str(c[1]).strip()]
-                zip_buffer = io.BytesIO()
-                progress = st.progress(0)
-                with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-                    for i, (b, l) in enumerate(combinations):
-                        pdf, _ = generate_report_from_df(df, str(b), str(l), spreadsheet_url=fallback_url)
-                        zip_file.writestr(f"{b}_{l}_report.pdf".replace("/", "-"), pdf)
-                        progress.progress((i + 1) / len(combinations))
-                st.download_button("📥 Download ZIP", data=zip_buffer.getvalue(), file_name="Reports.zip")
-            except Exception as e: st.error(f"Failed: {e}")
+
+        def record_week():
+            # Only bulk runs over live sheet data store this week's metrics; uploads,
+            # snapshots and single-report previews just read the history for trends
+            if history is not None and mode == "🌐 Google Sheets":
+                record_metrics(prepared, history)
+
+        if col_b1.button("🗂️ Bulk Generate All Reports"):
+            record_week()
+            bundle = {"One PDF per outlet": "outlet", "One PDF per brand": "brand", "One PDF for the fleet": "fleet"}[bundle_mode]
+            job_queue.submit('generate', f"Generate: {bundle_mode}", generate_job, prepared, mode=bundle, owner=owner,
+                             workers=pdf_workers, spreadsheet_url=fallback_url, include_ai=include_ai, history=history)
 
         if col_b2.button("✉️ Bulk Email All Managers"):
-            try:
-                combinations = df[[brand_col, loc_col]].drop_duplicates().values.tolist()
-                combinations = [c for c in combinations if str(c[0]).strip() and str(c[1]).strip()]
-                progress = st.progress(0)
-                success_count = 0
-                for i, (b, l) in enumerate(combinations):
-                    try:
-                        pdf, email = generate_report_from_df(df, str(b), str(l), spreadsheet_url=fallback_url)
-                        if email and "@" in str(email):
-                            success, _ = send_email(pdf, email, str(b))
-                            if success: success_count += 1
-                    except: pass
-                    progress.progress((i + 1) / len(combinations))
-                st.success(f"📨 Sent {success_count} / {len(combinations)} emails!")
-            except Exception as e: st.error(f"Failed: {e}")
+            record_week()
+            job_queue.submit('email', "Email all managers", email_job, prepared, owner=owner, **email_options)
+
+        # Email runs that stopped early (and are not being worked on) can be resumed without duplicates,
+        # but only on the data they were started on: outlets are matched by name
+        journal = get_journal()
+        unfinished = journal.latest_unfinished('email', exclude={job.run_id for job in job_queue.active()}, source=source)
+        if unfinished:
+            counts = unfinished["counts"]
+            remaining = sum(n for state, n in counts.items() if state not in DONE_STATES['email'])
+            st.info(f"⏸️ Email run {unfinished['run_id']} ({unfinished['created_at']}, {unfinished['status']}) has {remaining} outlets unsent: "
+                    + ", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
+            if st.button("▶️ Resume Email Run"):
+                job = job_queue.submit('email', f"Resume email run {unfinished['run_id']}", email_job, prepared,
+                                       run_id=unfinished["run_id"], owner=owner, **email_options)
+                # Known before the job starts, so the run is not offered again while queued
+                job.run_id = unfinished["run_id"]
+                st.rerun()
+
+        active_jobs(owner)
+        finished_jobs = [job for job in job_queue.jobs(owner=owner) if job.finished]
+        for i, job in enumerate(finished_jobs[:5]):
+            icon = {"done": "✅", "failed": "❌", "cancelled": "⛔"}[job.status]
+            with st.expander(f"{icon} {job.label} — {job.status}", expanded=i == 0):
+                if job.summary: st.caption(job.summary)
+                if job.error: st.error(f"Failed: {job.error}")
+                # download_button holds the whole file in memory on every rerun, so only the
+                # output the user asked for is loaded
+                if job.output and os.path.exists(job.output):
+                    if st.session_state.get("prepared_download") != job.job_id:
+                        if st.button(f"📦 Prepare download ({os.path.getsize(job.output) / 1024 / 1024:.1f} MB)", key=f"prepare_{job.job_id}"):
+                            st.session_state["prepared_download"] = job.job_id
+                            st.rerun()
+                    else:
+                        with open(job.output, "rb") as f:
+                            mime = "application/pdf" if job.output.endswith(".pdf") else "application/zip"
+                            st.download_button(f"📥 Download {job.output_name}", data=f, file_name=job.output_name, mime=mime, key=f"download_{job.job_id}")
+                show_outlets(job)
             
-    else: st.warning(f"Could not find Brand/Location columns.")
+    else: st.warning(f"Could not find Brand/Location columns. Found: {list(resolve_columns(df.columns).header)}")
 else: st.info("Please provide a data source to begin.")
 st.caption("Kychens Intelligence System v1.5")
\ No newline at end of file
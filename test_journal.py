@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+import pandas as pd
+import pdfkit
+
+from journal import RunJournal
+from main import email_reports
+
+class RecordingMailer:
+    """
+    Stands in for Mailer: records every delivery instead of talking to an SMTP server.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send_report(self, pdf, recipient, brand):
+        self.sent.append(recipient)
+        return True, "ok"
+
+    def send_reports(self, items, recipient):
+        self.sent.append(recipient)
+        return True, "ok"
+
+    def close(self):
+        pass
+
+def test():
+    # Bulk email resumes deliver each outlet at most once, and a send cut off mid-flight
+    # ends as 'unconfirmed' instead of keeping the run unfinished forever.
+    pdfkit.from_string = lambda html, output_path=False, **kwargs: b"%PDF-1.4 test"
+    # Forked PDF workers inherit the stub above; this test runs no other threads
+    os.environ['PDF_WORKER_START_METHOD'] = 'fork'
+    folder = tempfile.mkdtemp()
+    journal = RunJournal(os.path.join(folder, "journal.sqlite3"))
+    df = pd.DataFrame({
+        'Brand': ['BK', 'BK', 'BK'],
+        'Location': ['A', 'B', 'C'],
+        'Orders': [10, 20, 30],
+        'KPT': [5, 6, 7],
+        'Kitchen Errors': [0, 1, 2],
+        'Manager_Email': ['a@x.com', 'b@x.com', 'c@x.com'],
+    })
+    run_id = journal.start_run('email', [('BK', 'A'), ('BK', 'B'), ('BK', 'C')])
+
+    # The process "dies" after claiming A: the claim is left in 'sending'
+    journal.claim(run_id, 'a@x.com', [('BK', 'A')])
+
+    mailer = RecordingMailer()
+    outcomes = email_reports(df, render_workers=1, mailer=mailer, journal=journal, run_id=run_id, use_cache=False)
+    assert sorted(mailer.sent) == ['b@x.com', 'c@x.com'], mailer.sent
+    assert [(o.location, o.status) for o in outcomes] == [('A', 'unconfirmed'), ('B', 'sent'), ('C', 'sent')]
+    assert journal.pending(run_id) == []
+    assert journal.run(run_id)["status"] == "complete"
+    assert journal.latest_unfinished('email') is None
+
+    # Resuming again sends nothing
+    for state in ('rendered', 'pending'):
+        journal.mark(run_id, 'BK', 'B', state)
+    outcomes = email_reports(df, [('BK', 'B')], render_workers=1, mailer=mailer, journal=journal, run_id=run_id, use_cache=False)
+    assert [o.status for o in outcomes] == ['sent'] and len(mailer.sent) == 2
+    print("✅ Journal delivers at most once")
+
+if __name__ == "__main__":
+    test()
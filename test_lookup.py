@@ -0,0 +1,30 @@
+import pandas as pd
+import pdfkit
+
+from main import _outlet_context, generate_report_from_df, prepare_data
+
+def test():
+    # Outlets with non-ASCII names are indexed and looked up with the same normalization,
+    # so they are found and get their fleet metrics and peers.
+    pdfkit.from_string = lambda html, output_path=False, **kwargs: b"%PDF-1.4 test"
+    df = pd.DataFrame({
+        'Brand': ['Café Noir', 'Café Noir', 'Burger King'],
+        'Location': ['Pune', 'Mumbai', 'Bengaluru'],
+        'Orders': [200, 100, 50],
+        'KPT': [5, 6, 7],
+        'Kitchen Errors': [4, 1, 2],
+        'Manager_Email': ['a@x.com', 'b@x.com', 'c@x.com'],
+    })
+    prepared = prepare_data(df)
+
+    pdf, email = generate_report_from_df(prepared, 'Café Noir', 'Pune')
+    assert pdf.startswith(b"%PDF") and email == 'a@x.com'
+
+    context, _ = _outlet_context(prepared, 'Café Noir', 'Pune')
+    assert context['error_pct'] == 2
+    assert context['peers'] and context['peers']['fleet_rank'] == 2
+    assert prepared.manager_email('Café Noir', 'Mumbai') == 'b@x.com'
+    print("✅ Non-ASCII outlets are found")
+
+if __name__ == "__main__":
+    test()
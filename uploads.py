@@ -0,0 +1,129 @@
+import io
+import os
+import time
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from pandas.api.types import union_categoricals
+
+from main import MISSING_VALUES, to_category, to_number
+from schema import TEXT_FIELDS, require_columns, resolve_columns
+from snapshots import snapshot_store
+
+def _is_csv(filename):
+    return filename.lower().endswith('.csv')
+
+def upload_columns(header):
+    """
+    Maps a file header to the columns reports use, via the shared schema resolver.
+    Returns {original header label: 'text' or 'number'} in header order; raises ValueError without Brand/Location.
+    """
+    labels = {}
+    for c in header:
+        labels.setdefault(str(c).strip(), c)
+    mapping = resolve_columns(labels)
+    require_columns(mapping)
+    kinds = {}
+    for field, col in mapping.columns.items():
+        kinds.setdefault(labels[col], 'text' if field in TEXT_FIELDS else 'number')
+    return kinds
+
+def _compact_chunk(chunk, kinds):
+    chunk.columns = [str(c).strip() for c in chunk.columns]
+    return pd.DataFrame({
+        str(col).strip(): (to_category if kind == 'text' else to_number)(chunk[str(col).strip()])
+        for col, kind in kinds.items()
+    })
+
+def _concat_chunks(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    combined = {}
+    for col in chunks[0].columns:
+        parts = [c[col] for c in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            combined[col] = pd.Series(union_categoricals(parts))
+        else:
+            combined[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(combined)
+
+def read_upload(data, filename, chunk_rows=None):
+    """
+    Parses an uploaded CSV or Excel file (raw bytes) into a compact DataFrame.
+    The header is read first; only the columns reports use are parsed, text as categoricals
+    and metrics as floats. CSVs are streamed in chunks of chunk_rows (UPLOAD_CHUNK_ROWS, default 100000).
+    """
+    if chunk_rows is None:
+        chunk_rows = int(os.getenv('UPLOAD_CHUNK_ROWS', 100000))
+    buffer = io.BytesIO(data)
+
+    # 1. Sniff the header
+    header = pd.read_csv(buffer, nrows=0).columns if _is_csv(filename) else pd.read_excel(buffer, nrows=0).columns
+    kinds = upload_columns(header)
+    dtypes = {col: str for col, kind in kinds.items() if kind == 'text'}
+    buffer.seek(0)
+
+    # 2. Read only those columns
+    if not _is_csv(filename):
+        sheet = pd.read_excel(buffer, usecols=list(kinds), dtype=dtypes, na_values=MISSING_VALUES, thousands=',')
+        return _compact_chunk(sheet, kinds)
+    reader = pd.read_csv(buffer, usecols=list(kinds), dtype=dtypes, na_values=MISSING_VALUES, thousands=',',
+                         engine='c', chunksize=max(1, chunk_rows))
+    chunks = [_compact_chunk(chunk, kinds) for chunk in reader]
+    if not chunks:
+        return _compact_chunk(pd.DataFrame(columns=list(kinds)), kinds)
+    return _concat_chunks(chunks)
+
+class UploadCache:
+    """
+    Parsed uploads keyed by a hash of the file content, so reruns and other sessions
+    that upload the same file skip parsing. Keeps the max_entries most recent files.
+    With a SnapshotStore, each newly parsed file is also written as a snapshot.
+    """
+
+    def __init__(self, max_entries=8, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()  # sha256 -> (df, loaded_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def load(self, data, filename, force=False):
+        """
+        Returns the parsed DataFrame for this file content, parsing it only on a cache miss.
+        """
+        key = self.content_hash(data)
+        with self._lock:
+            if not force and key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        df = read_upload(data, filename)
+        with self._lock:
+            self._entries[key] = (df, time.time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.store is not None:
+            try:
+                self.store.write(df, sources={f"upload:{filename}": key})
+            except Exception:
+                pass
+        return df
+
+    def age(self, data):
+        """
+        Seconds since this file content was parsed, or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(self.content_hash(data))
+        return time.time() - entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every Streamlit session in this process
+upload_cache = UploadCache(store=snapshot_store)